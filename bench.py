@@ -0,0 +1,476 @@
+"""Benchmarks for tde.py on a synthetic disclosure package.
+
+`bench.py generate DIR -n RECORDS` writes a package with calls.json,
+messages.json, user_shard.json, media/ and voicemail/ in the layout
+described in the README, sized by the number of calls and messages.
+
+`bench.py run` times the stages of an export of a package (generated
+on the fly if none is given) for each output format, and the peak
+memory of each, and saves the results as JSON. Stages are cumulative,
+as in a real export each one streams the records through the ones
+before it: load (read the contacts, and read and classify the calls
+and messages), merge (+ merge them chronologically), render (+ render
+each entry) and write (+ write the transcript). The time a stage adds
+is shown as SELF. filter (one contact's calls and messages) and media
+(list the media directories and look up every media file) are timed
+on their own.
+
+`bench.py check` reads the ends of each file of a generated package, as
+a directory and as a stored ZIP file, and reports any date range that
+doesn't give the records it should, e.g. one starting after the last
+record of a file.
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import platform
+import random
+import sys
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timezone, timedelta
+from sys import exit
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+import tde
+
+
+def generate(path, records, contacts, seed):
+    """Writes a synthetic package of about records calls and messages
+    with the given number of contacts to the directory path. The same
+    seed always gives the same package."""
+    rnd = random.Random(seed)
+    path = Path(path)
+    (path / 'media').mkdir(parents=True, exist_ok=True)
+    (path / 'voicemail').mkdir(exist_ok=True)
+
+    # contacts, the first ones calling and texting the most
+    numbers = rnd.sample(range(2000000, 9999999), contacts)
+    numbers = [f'+1503{n}' for n in numbers]
+    people = [{'contact_value': n, 'name': contact_name(rnd, i)}
+              for (i, n) in enumerate(numbers)]
+    # contacts without a usable name, as found in real packages
+    people += [{'contact_value': n, 'name': n} for n in numbers[:contacts // 10]]
+    weights = [1 / (i + 1) for i in range(contacts)]
+
+    write_json_array(path / 'calls.json',
+                     (make_call(rnd, ts, numbers, weights)
+                      for ts in timestamps(rnd, int(records * call_fraction))))
+    media = []
+    write_json_array(path / 'messages.json',
+                     (make_message(rnd, i, ts, numbers, weights, media)
+                      for (i, ts) in enumerate(timestamps(rnd, records - int(records * call_fraction)))))
+
+    for (kind, name) in media:
+        roll = rnd.random()
+        if roll < 0.005:
+            continue  # missing from the package
+        directory = 'voicemail' if kind == 'voicemail' and roll > 0.05 else 'media'
+        # the name makes each file's content, and so its hash, unique
+        (path / directory / name).write_bytes(media_magic[Path(name).suffix]
+                                              + name.encode() + bytes(64))
+
+    user_shard = {
+        'users': [{'username': 'bench', 'email': 'bench@example.com'}],
+        'user_attributes': [],
+        'sessions': [{'created_at': iso(rnd.uniform(start_epoch, end_epoch), 'Z'),
+                      'ip': f'10.0.{rnd.randrange(256)}.{rnd.randrange(256)}',
+                      'user_agent': 'TextNow/1.0 "bench" [{}]'}
+                     for _ in range(200)],
+        'subscriptions': [],
+        'identities': [],
+        'devices': [{'device_id': f'{i:016x}'} for i in range(5)],
+        'contacts': people,
+    }
+    with open(path / 'user_shard.json', 'w', encoding='utf-8') as f:
+        json.dump(user_shard, f, indent=2)
+
+### BEGIN helper functions for generate()
+def write_json_array(path, objs):
+    """Writes objs as a JSON array formatted like the package files,
+    one object at a time."""
+    with open(path, 'w', encoding='utf-8', buffering=1 << 20) as f:
+        f.write('[')
+        sep = '\n  '
+        for obj in objs:
+            f.write(sep)
+            f.write(json.dumps(obj, indent=2, ensure_ascii=False).replace('\n', '\n  '))
+            sep = ',\n  '
+        f.write('\n]')
+
+def timestamps(rnd, n):
+    """Yields n increasing epochs spread over the history."""
+    step = (end_epoch - start_epoch) / max(n, 1)
+    for i in range(n):
+        yield start_epoch + (i + rnd.random()) * step
+
+def iso(epoch, zone):
+    """The ISO datetime of epoch as written in the package files."""
+    dt = datetime.fromtimestamp(int(epoch), timezone.utc)
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.000') + zone
+
+def contact_name(rnd, i):
+    """A name of letters only, unique for each i."""
+    suffix = ''
+    while True:
+        i, d = divmod(i, 26)
+        suffix = chr(ord('a') + d) + suffix
+        if i == 0:
+            return rnd.choice(first_names) + suffix
+
+def make_call(rnd, ts, numbers, weights):
+    other = rnd.choices(numbers, weights)[0]
+    incoming = rnd.random() < 0.6
+    return {
+        'start_time': iso(ts, '+00:00'),
+        'duration': float(int(rnd.expovariate(1 / 180))),
+        'caller': other if incoming else tde.me,
+        'called': tde.me if incoming else other,
+    }
+
+def make_message(rnd, i, ts, numbers, weights, media):
+    """A message to or from one of numbers. Media and voicemail
+    messages add (kind, file name) to media."""
+    other = rnd.choices(numbers, weights)[0]
+    roll = rnd.random()
+    if roll < 0.01:
+        name = f'v{i:07d}.wav'
+        media.append(('voicemail', name))
+        text = f'https://voicemail-media.textnow.com/?h={name}'
+    elif roll < 0.04:
+        # the URL of a media message leaves out the extension
+        name = f'h{i:07d}'
+        media.append(('media', name + rnd.choice(list(media_magic))))
+        text = f'https://media.textnow.com/?h={name}'
+    elif roll < 0.05:
+        text = f'Missed call from {other}'
+    else:
+        text = ' '.join(rnd.choices(words, k=rnd.randint(1, 20)))
+    return {
+        'username': 'bench',
+        'device_id': '',
+        'direction': rnd.choice([tde.incoming, tde.outgoing]),
+        'contact_value': other,
+        'contact_name': other,
+        'date': iso(ts, 'Z'),
+        'message': text,
+        'read': 1,
+        'deleted': 0,
+    }
+### END helper functions for generate()
+
+
+def run_benchmarks(path, formats, repeat, work):
+    """Returns the result of each stage for the package at path, the
+    fastest of repeat runs, each run in a new process so that its peak
+    memory is its own."""
+    results = []
+    plan = [('load', None), ('filter', None), ('media', None), ('merge', None)]
+    plan += [(stage, fmt) for fmt in formats for stage in ['render', 'write']]
+    spawn = multiprocessing.get_context('spawn')
+    for (stage, fmt) in plan:
+        runs = []
+        for _ in range(repeat):
+            with spawn.Pool(1) as pool:
+                runs.append(pool.apply(run_stage, (stage, fmt, str(path), str(work))))
+        best = min(runs, key=lambda r: r['seconds'])
+        best['peak_mb'] = max((r['peak_mb'] for r in runs if r['peak_mb'] is not None),
+                              default=None)
+        results.append({'stage': stage, 'format': fmt, **best})
+        print_result(results, results[-1])
+    return results
+
+### BEGIN helper functions for run_benchmarks()
+def run_stage(stage, fmt, path, work):
+    """Runs one stage in a worker process and returns its time, the
+    number of records it handled and the peak memory of the process."""
+    package = tde.package = tde.Package(path)
+    # keep the caches of the package out of the way, so that every
+    # run starts cold and the package is left as it was
+    work = Path(work)
+    package.contacts_path = work / 'contacts.json'
+    package.media_index_path = work / 'media-manifest.json'
+    package.index_path = work / 'index.sqlite'
+    for p in [package.contacts_path, package.media_index_path]:
+        p.unlink(missing_ok=True)
+
+    t0 = time.perf_counter()
+    # json2txt() prints a line per media file
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        count = stages[stage](package, fmt, work)
+    seconds = time.perf_counter() - t0
+
+    peak = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes, or bytes on macOS
+        peak /= 1 << 20 if sys.platform == 'darwin' else 1 << 10
+    return {'seconds': seconds, 'records': count, 'peak_mb': peak}
+
+def stage_load(package, fmt, work):
+    contacts = tde.ContactMap(tde.read_contacts_from_user_shard(package))
+    count = 0
+    for (name, key) in [('calls.json', 'start_time'), ('messages.json', 'date')]:
+        with package.open(name) as f:
+            for obj in tde.stream_json_array(f):
+                tde.Record(obj)
+                count += 1
+    return count
+
+def stage_filter(package, fmt, work):
+    # the contact with the most calls and messages
+    pn = next(iter(package.contacts().items()))[0]
+    return count_records(pn)
+
+def stage_media(package, fmt, work):
+    tde.media_index = tde.load_media_index()
+    count = 0
+    for rec in records():
+        if rec.type == 'voicemail-media':
+            tde.find_media(rec.media, ['voicemail', 'media'])
+        elif rec.type == 'media':
+            tde.find_media(rec.media, ['media', 'voicemail'], any_extension=True)
+        else:
+            continue
+        count += 1
+    return count
+
+def stage_merge(package, fmt, work):
+    return count_records(None)
+
+def stage_render(package, fmt, work):
+    opts = transcript_opts(fmt, work)
+    contacts = package.contacts()
+    count = 0
+    for rec in records():
+        tde.render(rec, opts, contacts)
+        count += 1
+    return count
+
+def stage_write(package, fmt, work):
+    opts = transcript_opts(fmt, work)
+    t = tde.Transcript(opts, package.contacts())
+    for rec in records():
+        t.write(rec)
+    t.close()
+    return t.count
+
+def records(pn=None):
+    """All the calls and messages of the package, merged."""
+    (first, last) = tde.get_default_date_interval()
+    return tde.merge_calls_messages(first.isoformat(), last.isoformat(), pn)
+
+def count_records(pn):
+    return sum(1 for _ in records(pn))
+
+def transcript_opts(fmt, work):
+    """The options of an export of the whole history as fmt."""
+    flags = {'txt': [], 'html': ['--html'], 'json': ['--json'], 'ndjson': ['--ndjson']}
+    opts = tde.make_parser().parse_args(
+        flags[fmt] + ['-r', '-f', str(Path(work) / f'bench.{fmt}')])
+    tde.check_transcript_args(opts)
+    return opts
+
+def print_result(results, r):
+    """Prints a row of the results table, with the time the stage adds
+    to the stage before it."""
+    if len(results) == 1:
+        print(f'{"STAGE":<8} {"FORMAT":<7} {"SECONDS":>9} {"SELF":>9} '
+              f'{"RECORDS":>10} {"RECORDS/S":>11} {"PEAK MB":>8}')
+    before = {'merge': ('load', None), 'render': ('merge', None),
+              'write': ('render', r['format'])}.get(r['stage'])
+    prior = [p for p in results if (p['stage'], p['format']) == before]
+    own = r['seconds'] - prior[0]['seconds'] if prior else r['seconds']
+    rate = r['records'] / r['seconds'] if r['seconds'] else 0
+    peak = '-' if r['peak_mb'] is None else f'{r["peak_mb"]:.1f}'
+    print(f'{r["stage"]:<8} {r["format"] or "-":<7} {r["seconds"]:>9.3f} {own:>9.3f} '
+          f'{r["records"]:>10} {rate:>11.0f} {peak:>8}', flush=True)
+
+def compare(results, path):
+    """Prints the change in time and peak memory of each stage since
+    the results saved at path."""
+    with open(path, encoding='utf-8') as f:
+        old = {(r['stage'], r['format']): r for r in json.load(f)['results']}
+    print(f'\nCOMPARED WITH {path}')
+    print(f'{"STAGE":<8} {"FORMAT":<7} {"SECONDS":>9} {"CHANGE":>8} {"PEAK MB":>8} {"CHANGE":>8}')
+    for r in results:
+        o = old.get((r['stage'], r['format']))
+        if o is None:
+            continue
+        dt = f'{(r["seconds"] / o["seconds"] - 1) * 100:+.1f}%' if o['seconds'] else '-'
+        dm = '-'
+        if r['peak_mb'] and o['peak_mb']:
+            dm = f'{(r["peak_mb"] / o["peak_mb"] - 1) * 100:+.1f}%'
+        print(f'{r["stage"]:<8} {r["format"] or "-":<7} {r["seconds"]:>9.3f} {dt:>8} '
+              f'{r["peak_mb"] or 0:>8.1f} {dm:>8}')
+### END helper functions for run_benchmarks()
+
+
+def check(path, work):
+    """Returns the failures of stream_date_range() on the package at
+    path, and on a stored ZIP file of it written to work: for d1 before
+    the first record, at the last record, just past it and well past
+    it, each file must give the records in the range and nothing else."""
+    zip_path = Path(work) / 'package.zip'
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as z:
+        for p in Path(path).rglob('*'):
+            z.write(p, Path('textnow-data', p.relative_to(path)))
+
+    failures = []
+    for package_path in [path, zip_path]:
+        tde.package = tde.Package(package_path)
+        for (name, key) in [('calls.json', 'start_time'), ('messages.json', 'date')]:
+            with tde.package.open(name) as f:
+                values = [obj[key] for obj in tde.stream_json_array(f)]
+            last = max(values)
+            past = (datetime.fromisoformat(last) + timedelta(seconds=1)).isoformat()
+            for d1 in [min(values), last, past, '2099-01-01T00:00:00+00:00']:
+                d2 = '2099-12-31T00:00:00+00:00'
+                expected = sum(1 for v in values if d1 <= v <= d2)
+                try:
+                    got = sum(1 for _ in tde.stream_date_range(name, key, d1, d2))
+                except Exception as e:
+                    got = repr(e)
+                if got != expected:
+                    failures.append(f'{package_path}: {name} from {d1}: '
+                                    f'expected {expected} records, got {got}')
+    return failures
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Generates synthetic disclosure packages and benchmarks tde.py on them.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    gen = commands.add_parser('generate', help='Write a synthetic package to DIR')
+    gen.add_argument('dir', type=Path, metavar='DIR')
+    add_package_options(gen)
+
+    chk = commands.add_parser('check', help='Check date ranges at the ends of a generated package')
+    add_package_options(chk)
+
+    run = commands.add_parser('run', help='Time each stage of an export')
+    run.add_argument('--package', type=Path,
+                     help='The package to benchmark (default: a generated one)')
+    add_package_options(run)
+    run.add_argument('--formats', default='txt,html,json',
+                     type=lambda v: v.split(','),
+                     help='Comma separated output formats out of txt, html, json and ndjson (default: %(default)s)')
+    run.add_argument('--repeat', type=int, default=1, metavar='N',
+                     help='Keep the fastest of N runs of each stage (default: %(default)s)')
+    run.add_argument('-o', '--output', type=Path, default=default_results_file, metavar='FILE',
+                     help='Save the results as JSON to FILE (default: %(default)s)')
+    run.add_argument('--compare', type=Path, metavar='FILE',
+                     help='Compare the results with those saved in FILE')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        unknown = set(args.formats) - {'txt', 'html', 'json', 'ndjson'}
+        if unknown:
+            parser.error(f'unknown formats: {", ".join(sorted(unknown))}')
+    return args
+
+### BEGIN helper function for parse_args()
+def add_package_options(parser):
+    parser.add_argument('-n', '--records', type=int, default=100000,
+                        help='Number of calls and messages to generate (default: %(default)s)')
+    parser.add_argument('--contacts', type=int, default=200,
+                        help='Number of contacts to generate (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=1618,
+                        help='Seed of the generator (default: %(default)s)')
+### END helper function for parse_args()
+
+
+# GLOBALS ------
+call_fraction = 0.3  # of the generated records
+start_epoch = datetime(2016, 3, 14, tzinfo=timezone.utc).timestamp()
+end_epoch = start_epoch + timedelta(days=3460).total_seconds()
+first_names = ['Alex', 'Blair', 'Casey', 'Drew', 'Emery', 'Finley', 'Gray',
+               'Harper', 'Jordan', 'Kendall', 'Logan', 'Morgan', 'Parker',
+               'Quinn', 'Riley', 'Sawyer', 'Taylor']
+words = ['ok', 'yes', 'no', 'call', 'me', 'later', 'when', 'you', 'can',
+         'stop', 'by', 'and', 'see', 'it', 'tomorrow', 'tonight', 'thanks',
+         'on', 'my', 'way', 'running', 'late', 'sounds', 'good', 'where',
+         'are', 'café', 'meeting', 'at', 'the', 'usual', 'place', '"quoted"']
+# the first bytes of each kind of media file
+media_magic = {
+    '.png': b'\x89PNG\r\n\x1a\n',
+    '.gif': b'GIF89a',
+    '.jpeg': b'\xff\xd8\xff\xe0',
+    '.wav': b'RIFF\x00\x00\x00\x00WAVE',
+    '.mp4': b'\x00\x00\x00\x18ftypmp42',
+    '.3gpp': b'\x00\x00\x00\x18ftyp3gp4',
+    '.AMR': b'#!AMR\n',
+    '.pdf': b'%PDF-1.4\n',
+    '.vcf': b'BEGIN:VCARD\r\n',
+}
+stages = {
+    'load': stage_load,
+    'filter': stage_filter,
+    'media': stage_media,
+    'merge': stage_merge,
+    'render': stage_render,
+    'write': stage_write,
+}
+default_results_file = 'bench-results.json'
+# ---------------
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    if args.command == 'generate':
+        generate(args.dir, args.records, args.contacts, args.seed)
+        print(f'Saved a package of {args.records} calls and messages to "{args.dir}"')
+        exit()
+
+    if args.command == 'check':
+        with tempfile.TemporaryDirectory(prefix='tde-check-') as work:
+            package_path = Path(work) / 'textnow-data'
+            generate(package_path, args.records, args.contacts, args.seed)
+            failures = check(package_path, work)
+        for failure in failures:
+            print(failure)
+        if failures:
+            exit('FAILED')
+        print('OK')
+        exit()
+
+    with tempfile.TemporaryDirectory(prefix='tde-bench-') as work:
+        work = Path(work)
+        package_path = args.package
+        if package_path is None:
+            package_path = work / 'textnow-data'
+            t0 = time.perf_counter()
+            generate(package_path, args.records, args.contacts, args.seed)
+            print(f'Generated {args.records} calls and messages in '
+                  f'{time.perf_counter() - t0:.1f}s')
+        results = run_benchmarks(package_path, args.formats, args.repeat, work)
+
+        sizes = {name: os.path.getsize(Path(package_path, name))
+                 for name in ['calls.json', 'messages.json', 'user_shard.json']
+                 if Path(package_path, name).is_file()}
+        report = {
+            'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': tde.numpy is not None,
+            'package': str(args.package) if args.package else None,
+            'generated': None if args.package else
+                {'records': args.records, 'contacts': args.contacts, 'seed': args.seed},
+            'sizes': sizes,
+            'results': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f'Saved to "{args.output}"')
+
+        if args.compare:
+            compare(results, args.compare)
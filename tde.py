@@ -1,127 +1,1126 @@
 import argparse
+from array import array
+import atexit
+import bisect
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import cProfile
+import functools
+import gzip
+import hashlib
+import heapq
+import html
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import itertools
 import json
+import math
+import multiprocessing
+import os
 from pathlib import Path
+import queue
 import re
+import shlex
+import sqlite3
 import sys
+import threading
+import time
+import traceback
+import tracemalloc
+import zipfile
+import zlib
 from datetime import datetime, timezone, timedelta
 from sys import exit
-from urllib import parse
+from urllib import parse, request
+from urllib.error import HTTPError, URLError
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-def get_contacts_from_user_shard():
+try:
+    from compression import zstd  # Python 3.14
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+
+class Package:
+    """A TextNow data disclosure package, either the ZIP file it
+    arrives as or the directory it was extracted to. Files are named
+    relative to the root of the package, e.g. 'calls.json', 'media'.
+    Members of a ZIP file are read straight out of the archive, and
+    directories are listed from its central directory."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        if self.path.is_file() and zipfile.is_zipfile(self.path):
+            self.zip = zipfile.ZipFile(self.path)
+            # the files may be in a top level directory in the archive
+            names = [n for n in self.zip.namelist()
+                     if n == 'calls.json' or n.endswith('/calls.json')]
+            if not names:
+                raise ValueError(f'{self.path}: no calls.json in archive')
+            self.root = min(names, key=len)[:-len('calls.json')]
+            cache_dir, prefix = self.path.parent, self.path.stem + '-'
+        else:
+            self.zip = None
+            self.root = ''
+            cache_dir, prefix = self.path, ''
+        self.index_path = cache_dir / (prefix + 'tde-index.sqlite')
+        self.media_index_path = cache_dir / (prefix + 'tde-media-manifest.json')
+        self.contacts_path = cache_dir / (prefix + 'tde-contacts.json')
+        self.index_current = None  # set by open_index() on first use
+        self.contact_map = None
+
+    def contacts(self):
+        """Returns the ContactMap of the package, loading it on first use."""
+        if self.contact_map is None:
+            self.contact_map = get_contacts_from_user_shard(self)
+        return self.contact_map
+
+    def open(self, name, mode='r'):
+        """Opens a file in the package for reading, in text mode
+        (utf-8) or binary mode ('rb')."""
+        if self.zip is None:
+            if mode == 'rb':
+                return open(self.path / name, 'rb')
+            return open(self.path / name, encoding='utf-8')
+        f = self.zip.open(self.root + name)
+        return f if mode == 'rb' else io.TextIOWrapper(f, encoding='utf-8')
+
+    def seekable(self, name):
+        """Whether name can be read from an arbitrary offset cheaply.
+        A compressed ZIP member has to be decompressed from the start
+        on every backwards seek."""
+        if self.zip is None:
+            return True
+        info = self.zip.getinfo(self.root + name)
+        return info.compress_type == zipfile.ZIP_STORED
+
+    def signature(self, name):
+        """A string that changes when the file or directory name
+        changes, used to tell whether a cache is current."""
+        if self.zip is not None:
+            st = self.path.stat()
+            return f'{st.st_size}:{st.st_mtime_ns}'
+        p = self.path / name
+        if not p.exists():
+            return ''
+        st = p.stat()
+        return f'{st.st_size}:{st.st_mtime_ns}'
+
+    def exists(self, name):
+        """Whether the package has a file or directory name."""
+        if self.zip is None:
+            return (self.path / name).exists()
+        n = self.root + name
+        return any(m == n or m.startswith(n + '/') for m in self.zip.namelist())
+
+    def scandir(self, name):
+        """Returns {file name: signature} of the files in directory
+        name, where a signature changes when the file changes, as for
+        signature()."""
+        if self.zip is None:
+            p = self.path / name
+            if not p.is_dir():
+                return {}
+            with os.scandir(p) as it:
+                return {e.name: f'{e.stat().st_size}:{e.stat().st_mtime_ns}'
+                        for e in it if e.is_file()}
+        prefix = f'{self.root}{name}/'
+        return {i.filename[len(prefix):]: f'{i.file_size}:{i.date_time}:{i.CRC}'
+                for i in self.zip.infolist()
+                if i.filename.startswith(prefix) and '/' not in i.filename[len(prefix):]
+                and len(i.filename) > len(prefix)}
+
+    def listfiles(self, name):
+        """Returns the names of the files in directory name and its
+        subdirectories, relative to the root of the package, e.g.
+        'client_logs/2024/app.log'."""
+        if self.zip is None:
+            p = self.path / name
+            return sorted(c.relative_to(self.path).as_posix()
+                          for c in p.rglob('*') if c.is_file())
+        prefix = f'{self.root}{name}/'
+        return sorted(n[len(self.root):] for n in self.zip.namelist()
+                      if n.startswith(prefix) and not n.endswith('/'))
+
+    def file_path(self, *parts):
+        """The path of a file in the package as shown in transcripts.
+        For a ZIP file this is the path of the member inside it."""
+        return Path(self.path, self.root, *parts)
+
+
+class ContactMap:
+    """The contacts of a package: normalized phone number -> name, plus
+    an index of the trigrams of each name so that looking up a name by
+    a literal pattern only checks the names that could match."""
+
+    def __init__(self, contacts):
+        self.contacts = contacts
+        self.contacts['Restricted'] = ''
+        self.contacts['+2999999999'] = ''
+        # name -> [number, ...] and trigram -> {name, ...}
+        self.numbers = {}
+        self.trigrams = {}
+        for (number, name) in self.contacts.items():
+            self.numbers.setdefault(name, []).append(number)
+        for name in self.numbers:
+            lower = name.lower()
+            for i in range(len(lower) - 2):
+                self.trigrams.setdefault(lower[i:i + 3], set()).add(name)
+
+    def __contains__(self, number):
+        return number in self.contacts
+
+    def __len__(self):
+        return len(self.contacts)
+
+    def items(self):
+        return self.contacts.items()
+
+    def name(self, number):
+        """Returns the name of number, or '' if it isn't a contact."""
+        return self.contacts.get(normalize_number(number), '')
+
+    def search(self, pattern):
+        """Returns [(number, name), ...] for the names matching the
+        regular expression pattern, ignoring case, in contact order."""
+        regex = re.compile(pattern, flags=re.IGNORECASE)
+        if re.fullmatch(r'[\w ]{3,}', pattern):
+            # a literal: only names containing all its trigrams can match
+            lower = pattern.lower()
+            names = set.intersection(*(self.trigrams.get(lower[i:i + 3], set())
+                                       for i in range(len(lower) - 2)))
+        else:
+            names = self.numbers
+        matched = {n for n in names if regex.search(n)}
+        return [(p, n) for (p, n) in self.contacts.items() if n in matched]
+
+
+def get_contacts_from_user_shard(package):
+    """Returns the ContactMap of package. The normalized contacts are
+    cached in package.contacts_path and reused while user_shard.json
+    keeps the same size and mtime; otherwise they are taken from the
+    index if it is current, or else only the contacts array is read
+    out of user_shard.json."""
+    sig = package.signature('user_shard.json')
+    try:
+        with open(package.contacts_path, encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache['signature'] == sig:
+            return ContactMap(dict(cache['contacts']))
+    except (OSError, ValueError, KeyError):
+        pass
+
+    db = open_index()
+    if db is not None:
+        contacts = dict(db.execute('SELECT number, name FROM contacts ORDER BY rowid'))
+        db.close()
+    else:
+        contacts = read_contacts_from_user_shard(package)
+    try:
+        with open(package.contacts_path, 'w', encoding='utf-8') as f:
+            json.dump({'signature': sig, 'contacts': list(contacts.items())},
+                      f, ensure_ascii=False)
+    except OSError as e:
+        print_err('warning', f'could not save contacts: {e}')
+    return ContactMap(contacts)
+
+### BEGIN helper functions for get_contacts_from_user_shard()
+def read_contacts_from_user_shard(package):
     """Returns a dict in the form
     {'+1##########': 'name', ...}"""
     contacts = {}
 
-    with open('textnow-data/user_shard.json', 'r', encoding='utf-8') as f:
-        user_shard = json.load(f)
-    user_shard_contacts = user_shard['contacts']
-    del user_shard
+    # the rest of user_shard.json (users, sessions, devices, ...) is
+    # skipped without being parsed
+    with package.open('user_shard.json') as f:
+        for contact in stream_json_member(f, 'contacts'):
+            name = contact['name']
+            phone_number = normalize_number(contact['contact_value'])
 
-    for contact in user_shard_contacts:
-        name = contact['name']
-        phone_number = normalize_number(contact['contact_value'])
+            if not (isvalid_name(name) and phone_number):
+                continue
 
-        if not (isvalid_name(name) and phone_number):
-            continue
-
-        if phone_number in contacts:
-            if name != contacts[phone_number]:
-                raise ValueError(f'Name conflict: "{phone_number}": "{contacts[phone_number]}" and "{name}"')
-        else:
-            # create new item -> 'value': ['name']
-            contacts[phone_number] = name
+            if phone_number in contacts:
+                if name != contacts[phone_number]:
+                    raise ValueError(f'Name conflict: "{phone_number}": "{contacts[phone_number]}" and "{name}"')
+            else:
+                # create new item -> 'value': ['name']
+                contacts[phone_number] = name
 
-    contacts['Restricted'] = ''
-    contacts['+2999999999'] = ''
     return contacts
 
-### BEGIN helper function for get_contacts_from_user_shard()
 def isvalid_name(n):
     return name_pattern.search(n)
-### END helper function for get_contacts_from_user_shard()
-
-
-def merge_calls_messages(d1, d2, pn):
+### END helper functions for get_contacts_from_user_shard()
+
+
+def build_index():
+    """Loads user_shard.json, calls.json and messages.json into an
+    SQLite database at package.index_path, indexed by timestamp,
+    contact number and message type, so later runs query it instead of
+    parsing the JSON files. The words of each message are also stored
+    in an inverted index (the terms table), with the number of messages
+    holding each (the frequencies table), for --search. The index is
+    written to a temporary file and moved into place when complete."""
+    index_path = package.index_path
+    tmp_path = index_path.with_name(index_path.name + '.tmp')
+    tmp_path.unlink(missing_ok=True)
+    db = sqlite3.connect(tmp_path)
+    db.executescript(index_schema)
+
+    db.executemany('INSERT INTO contacts VALUES (?, ?)',
+                   read_contacts_from_user_shard(package).items())
+
+    with package.open('calls.json') as f:
+        db.executemany('INSERT INTO calls VALUES (NULL, ?, ?, ?, ?)', (
+            (c['start_time'], c['caller'], c['called'],
+             json.dumps(c, ensure_ascii=False))
+            for c in stream_json_array(f)))
+
+    with package.open('messages.json') as f:
+        for (i, m) in enumerate(stream_json_array(f), start=1):
+            db.execute('INSERT INTO messages VALUES (?, ?, ?, ?, ?)', (
+                i, m['date'], m['contact_value'], message_type(m)[0],
+                json.dumps(m, ensure_ascii=False)))
+            db.executemany('INSERT INTO terms VALUES (?, ?)',
+                           ((term, i) for term in tokenize(m['message'])))
+
+    db.execute('INSERT INTO frequencies SELECT term, COUNT(*) FROM terms GROUP BY term')
+    db.executescript(index_indexes)
+    db.executemany('INSERT INTO meta VALUES (?, ?)', source_signature().items())
+    db.commit()
+    db.close()
+    tmp_path.replace(index_path)
+    package.index_current = True
+
+### BEGIN helper functions for build_index()
+def open_index():
+    """Returns a connection to the index, or None if it has not been
+    built or the source files have changed since it was built. The
+    index is checked, and a warning given, once per run."""
+    index_path = package.index_path
+    if not index_path.exists():
+        return None
+    db = sqlite3.connect(index_path)
+    if package.index_current is None:
+        package.index_current = (
+            dict(db.execute('SELECT name, value FROM meta')) == source_signature())
+        if not package.index_current:
+            print_err('warning', f'{index_path} is out of date, ignoring it. '
+                      'Rebuild it with --index')
+    if not package.index_current:
+        db.close()
+        return None
+    return db
+
+def source_signature():
+    """The size and modification time of each source file, and the
+    version of the index layout, used to tell whether the index is
+    current."""
+    sig = {name: package.signature(name) for name in index_sources}
+    sig['version'] = str(index_version)
+    return sig
+
+def tokenize(text):
+    """Returns the distinct lower case words of text."""
+    return set(word_pattern.findall(text.lower()))
+### END helper functions for build_index()
+
+
+class Record:
+    """A call or message from calls.json or messages.json, classified
+    once when it is read, or an event from one of event_sources.
+
+    kind: 'call', 'message' or 'event'
+    ts: the time in epoch milliseconds, so merges and date filters
+        compare integers
+    number: the normalized number of the other party. For an event,
+        the first number other than mine it mentions, or ''
+    direction: incoming or outgoing, None for an event
+    type: in, out, text, missed-call, media or voicemail-media, or the
+        source of an event, e.g. ips
+    media: the media file named in a media or voicemail message's URL,
+        else None
+    resolved: the media file as found by resolve_media(), once it has
+        been looked up
+    obj: the record as read from the file
     """
-    :rtype: list
+    __slots__ = ('kind', 'ts', 'number', 'direction', 'type', 'media',
+                 'resolved', 'obj')
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.resolved = None
+        if 'date' in obj:
+            self.kind = 'message'
+            self.ts = iso2ms(obj['date'])
+            self.number = normalize_number(obj['contact_value'])
+            self.direction = obj['direction']
+            self.type, self.media = message_type(obj)
+        elif 'start_time' in obj:
+            self.kind = 'call'
+            self.ts = iso2ms(obj['start_time'])
+            self.media = None
+            called = normalize_number(obj['called'])
+            if called == me:
+                self.type, self.direction = 'in', incoming
+                self.number = normalize_number(obj['caller'])
+            else:
+                self.type, self.direction = 'out', outgoing
+                self.number = called
+        else:
+            print(obj)
+            raise TypeError('Unknown object type')
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for (slot, value) in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+### BEGIN helper functions for Record
+def iso2ms(iso):
+    """Converts an ISO datetime string to epoch milliseconds."""
+    return round(datetime.fromisoformat(iso).timestamp() * 1000)
+
+def dates2ms(d1, d2):
+    """Converts the datetimes d1 and d2 ending a date range to epoch
+    milliseconds, d1 rounded up and d2 down, so the range holds no
+    record from outside it, e.g. at midnight of the next day."""
+    return (math.ceil(d1.timestamp() * 1000), math.floor(d2.timestamp() * 1000))
+
+def record_key(rec):
+    return rec.ts
+
+def event_record(source, obj, ts, texts):
+    """Returns the Record of the event obj from source at ts (epoch
+    milliseconds). Its number is looked for in the strings texts."""
+    rec = Record.__new__(Record)
+    rec.kind, rec.ts, rec.type, rec.obj = 'event', ts, source, obj
+    rec.direction = rec.media = rec.resolved = None
+    rec.number = next((n for text in texts for n in event_number_pattern.findall(text)
+                       if n != me), '')
+    return rec
+### END helper functions for Record
+
+
+def merge_calls_messages(d1, d2, pn, events=()):
+    """Yields the calls and messages between d1 and d2 to or from pn
+    (all contacts if pn is None) in chronological order, as Records,
+    along with the events of the sources named in events (see
+    read_events()) that fall in the same dates and mention pn.
+    Records are read, filtered and merged lazily, so the first one is
+    available before the rest have been read.
+    :rtype: generator
     """
+    # events come after calls and messages on equal timestamps
+    event_streams = [filter_contact(read_events(source, d1, d2), pn)
+                     for source in events]
+
+    db = open_index()
+    if db is not None:
+        try:
+            # calls first so they come first on equal timestamps
+            yield from merge_sources(query_calls(db, d1, d2, pn),
+                                     query_messages(db, d1, d2, pn),
+                                     *event_streams)
+        finally:
+            db.close()
+        return
+
+    # the data in each file is already sorted by date, so seek to d1
+    # in each file, stream until past d2, and merge on the fly
+    yield from merge_sources(
+        filter_contact(map(Record, stream_date_range('calls.json', 'start_time', d1, d2)), pn),
+        filter_contact(map(Record, stream_date_range('messages.json', 'date', d1, d2)), pn),
+        *event_streams)
+
+
+def search_messages(query, context, d1, d2, pn):
+    """Yields, in chronological order, the messages between d1 and d2
+    to or from pn (all contacts if pn is None) that contain every word
+    of query, each with up to context calls and messages with the same
+    contact before and after it. Matches are found in the inverted
+    index, so the time taken depends on the number of matches, not on
+    the number of messages."""
+    db = open_index()
+    if db is None:
+        print(f'Building index "{package.index_path}" for --search')
+        build_index()
+        db = open_index()
 
-    # load call data
-    with open('textnow-data/calls.json', encoding='utf-8') as f:
-        call_data = json.load(f)
-
-    incident_calls = []
-    for call in call_data:
-        if d1 <= call['start_time'] <= d2:
-            if pn is None:
-                incident_calls.append(call)
-            elif pn == call['caller'] or pn == call['called']:
-                incident_calls.append(call)
-
-    # load message data
-    with open('textnow-data/messages.json', encoding="utf-8") as f:
-        message_data = json.load(f)
-
-    incident_messages = []
-    for message in message_data:
-        if d1 <= message['date'] <= d2:
-            if pn is None:
-                incident_messages.append(message)
-            elif pn == message['contact_value']:
-                incident_messages.append(message)
-
-    # the data in each file is already sorted by date
-    # so just have to merge them together based on date
-    return merge_longest(incident_calls, incident_messages)
-
-
-### BEGIN Helper function for merge_calls_messages()
-def merge_longest(calls, messages):
-    """An ad hoc version of itertools.zip_longest.
-    Instead of returning a list of tuples, it returns
-    the two lists merged in chronological order."""
-    if len(calls) == 0 or len(messages) == 0:
-        return calls + messages
-    merged = []
-    c = iter(calls)
-    m = iter(messages)
-    call = next(c)
-    message = next(m)
+    try:
+        records = {}
+        for (i, d, cv, j) in query_terms(db, tokenize(query)):
+            if not d1 <= d <= d2 or (pn is not None and cv != pn):
+                continue
+            rec = Record(json.loads(j))
+            records[('message', i)] = rec
+            if context > 0:
+                records.update(query_context(db, rec.ts, i, d, cv, context))
+    finally:
+        db.close()
+
+    # calls before messages on equal timestamps, as in merge_sources()
+    yield from (rec for (key, rec) in
+                sorted(records.items(), key=lambda item: (item[1].ts, item[0])))
+
+
+### BEGIN Helper functions for merge_calls_messages()
+def query_terms(db, terms):
+    """Returns (id, date, contact_value, json) of the messages that
+    contain all of terms. Only the postings of the rarest term are
+    fetched, and narrowed down by each of the others in turn."""
+    if not terms:
+        return []
+    counts = {}
+    for term in terms:
+        row = db.execute('SELECT count FROM frequencies WHERE term = ?', (term,)).fetchone()
+        if row is None:
+            return []
+        counts[term] = row[0]
+    (rarest, *others) = sorted(terms, key=counts.get)
+    ids = [i for (i,) in db.execute(
+        'SELECT message_id FROM terms WHERE term = ?', (rarest,))]
+    # stay under SQLite's limit on the number of parameters
+    for term in others:
+        narrowed = []
+        for n in range(0, len(ids), 500):
+            batch = ids[n:n + 500]
+            narrowed += (i for (i,) in db.execute(
+                'SELECT message_id FROM terms WHERE term = ? '
+                f'AND message_id IN ({",".join("?" * len(batch))})', (term, *batch)))
+        ids = narrowed
+        if not ids:
+            return []
+    ids = sorted(ids)
+    rows = []
+    for n in range(0, len(ids), 500):
+        batch = ids[n:n + 500]
+        rows += db.execute(
+            'SELECT id, date, contact_value, json FROM messages '
+            f'WHERE id IN ({",".join("?" * len(batch))})', batch)
+    return rows
+
+def query_context(db, ts, i, d, cv, n):
+    """Returns {(kind, id): Record} for the n calls and messages with
+    contact cv nearest before and after message i at date d (ts in
+    epoch milliseconds)."""
+    before = []
+    after = []
+    for (k, j) in db.execute(
+            'SELECT id, json FROM messages WHERE contact_value = ? '
+            'AND (date, id) < (?, ?) ORDER BY date DESC, id DESC LIMIT ?',
+            (cv, d, i, n)):
+        before.append((('message', k), Record(json.loads(j))))
+    for (k, j) in db.execute(
+            'SELECT id, json FROM messages WHERE contact_value = ? '
+            'AND (date, id) > (?, ?) ORDER BY date, id LIMIT ?',
+            (cv, d, i, n)):
+        after.append((('message', k), Record(json.loads(j))))
+    for (k, j) in db.execute(
+            'SELECT id, json FROM calls WHERE (caller = ? OR called = ?) '
+            'AND start_time < ? ORDER BY start_time DESC, id DESC LIMIT ?',
+            (cv, cv, d, n)):
+        before.append((('call', k), Record(json.loads(j))))
+    for (k, j) in db.execute(
+            'SELECT id, json FROM calls WHERE (caller = ? OR called = ?) '
+            'AND start_time >= ? ORDER BY start_time, id LIMIT ?',
+            (cv, cv, d, n)):
+        after.append((('call', k), Record(json.loads(j))))
+
+    # keep the n nearest on each side
+    before = [item for item in before if item[1].ts <= ts]
+    after = [item for item in after if item[1].ts >= ts]
+    before.sort(key=lambda item: (item[1].ts, item[0]))
+    after.sort(key=lambda item: (item[1].ts, item[0]))
+    return dict(before[-n:] + after[:n])
+
+def get_timespan():
+    """Returns {'calls.json': (first, last), 'messages.json': (first,
+    last)}, the ISO datetimes of the first and last record of each
+    file, leaving out a file with no records, or exits if neither has
+    any. They come from the index if there is a current one, else
+    only the first and last record of each file are read."""
+    timespan = {}
+    db = open_index()
+    if db is not None:
+        for (table, key) in [('calls', 'start_time'), ('messages', 'date')]:
+            span = db.execute(f'SELECT MIN({key}), MAX({key}) FROM {table}').fetchone()
+            if span[0] is not None:
+                timespan[f'{table}.json'] = span
+        db.close()
+    else:
+        for (name, key) in [('calls.json', 'start_time'), ('messages.json', 'date')]:
+            with package.open(name) as f:
+                first = next(stream_json_array(f), None)
+            if first is None:
+                continue
+            with package.open(name, 'rb') as fb:
+                last = last_json_array_element(fb)
+            timespan[name] = (first[key], last[key])
+    if not timespan:
+        exit(f'No calls or messages in "{package.path}"')
+    return timespan
+
+def get_default_date_interval():
+    """Returns [first, last], the aware datetimes of the earliest and
+    latest record in calls.json and messages.json. last is the end of
+    the second of the latest record, since records are compared as ISO
+    strings and '...:47+00:00' sorts before '...:47.000+00:00'."""
+    global default_date_interval
+    if default_date_interval is None:
+        isos = [iso for span in get_timespan().values() for iso in span]
+        last = datetime.fromisoformat(max(isos)).replace(microsecond=0)
+        default_date_interval = [datetime.fromisoformat(min(isos)),
+                                 last + timedelta(seconds=1, microseconds=-1)]
+    return default_date_interval
+
+def last_json_array_element(fb):
+    """Returns the last element of the JSON array of objects in the
+    binary file fb by reading backwards from the end of the file, a
+    growing chunk at a time, until the chunk holds a whole element."""
+    size = fb.seek(0, io.SEEK_END)
+    decoder = json.JSONDecoder()
+    chunk_size = read_chunk_size
     while True:
-        if datetime_key(call) < datetime_key(message):
-            merged.append(call)
+        start = max(size - chunk_size, 0)
+        fb.seek(start)
+        # the chunk may start in the middle of a utf-8 sequence
+        tail = fb.read(size - start).decode('utf-8', errors='ignore')
+        # try each { from the right: the last element is the first
+        # object found that is followed only by the closing bracket
+        pos = tail.rfind('{')
+        while pos != -1:
             try:
-                call = next(c)
-            except StopIteration:
-                # append the rest of messages onto merged
-                fill = m
+                obj, end = decoder.raw_decode(tail, pos)
+                if tail[end:].strip() == ']':
+                    return obj
+            except json.JSONDecodeError:
+                pass
+            pos = tail.rfind('{', 0, pos)
+        if start == 0:
+            raise ValueError(f'{getattr(fb, "name", fb)}: no objects in JSON array')
+        chunk_size *= 2
+
+def merge_sources(*sources):
+    """Merges any number of record streams, each already in
+    chronological order, into one chronological stream with a k-way
+    heap merge. On equal timestamps records from earlier sources come
+    first."""
+    return heapq.merge(*sources, key=record_key)
+
+def filter_contact(records, pn):
+    """Yields the records to or from pn, or all of them if pn is None."""
+    if pn is None:
+        yield from records
+    else:
+        for rec in records:
+            if involves(rec, pn):
+                yield rec
+
+def query_calls(db, d1, d2, pn):
+    """Yields the calls between d1 and d2 to or from pn (all contacts
+    if pn is None) from the index."""
+    if pn is None:
+        rows = db.execute(
+            'SELECT json FROM calls WHERE start_time BETWEEN ? AND ? '
+            'ORDER BY start_time, id', (d1, d2))
+    else:
+        rows = db.execute(
+            'SELECT json FROM calls WHERE start_time BETWEEN ? AND ? '
+            'AND (caller = ? OR called = ?) ORDER BY start_time, id',
+            (d1, d2, pn, pn))
+    for (j,) in rows:
+        yield Record(json.loads(j))
+
+def query_messages(db, d1, d2, pn):
+    """Yields the messages between d1 and d2 to or from pn (all
+    contacts if pn is None) from the index."""
+    if pn is None:
+        rows = db.execute(
+            'SELECT json FROM messages WHERE date BETWEEN ? AND ? '
+            'ORDER BY date, id', (d1, d2))
+    else:
+        rows = db.execute(
+            'SELECT json FROM messages WHERE date BETWEEN ? AND ? '
+            'AND contact_value = ? ORDER BY date, id', (d1, d2, pn))
+    for (j,) in rows:
+        yield Record(json.loads(j))
+
+
+def stream_date_range(name, key, d1, d2):
+    """Yields the records of the JSON array in package file name whose
+    key lies between d1 and d2. The array must be sorted by key. The
+    first record at or after d1 is found by bisection over the file,
+    and reading stops at the first record after d2."""
+    with package.open(name, 'rb') as fb:
+        offset = seek_date(fb, key, d1) if package.seekable(name) else None
+        if offset is None:
+            # the file can't be bisected (e.g. no record starts on its
+            # own line), so fall back to a linear scan from the start
+            fb.seek(0)
+            inside = False
+        else:
+            fb.seek(offset)
+            inside = True
+        f = io.TextIOWrapper(fb, encoding='utf-8')
+        for record in stream_json_array(f, inside=inside):
+            if record[key] > d2:
                 break
+            if record[key] >= d1:
+                yield record
+
+
+def seek_date(fb, key, d):
+    """Returns the byte offset in the binary file fb of the first
+    record whose key is at or after d, or the offset of the end of
+    the array if there is none. Returns None if records cannot be
+    located by line, e.g. the file is not pretty-printed."""
+    size = fb.seek(0, io.SEEK_END)
+    first = record_at(fb, 0, key)
+    if first is None:
+        return None
+
+    # invariant: every record starting before lo has key < d, and the
+    # first record starting at or after hi has key >= d
+    lo, hi = first[0], size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        r = record_at(fb, mid, key)
+        if r is None or r[1] >= d:
+            hi = mid
         else:
-            merged.append(message)
+            lo = r[0] + 1
+    r = record_at(fb, lo, key)
+    if r is None:
+        # past the last record: position on the closing bracket, as lo
+        # may be inside the last record rather than after it
+        start = max(size - read_chunk_size, 0)
+        fb.seek(start)
+        return start + fb.read().rfind(b']')
+    return r[0]
+
+### BEGIN helper function for seek_date()
+def record_at(fb, offset, key):
+    """Returns (start, key value) of the first record in the binary
+    file fb that starts on a line at or after offset, or None."""
+    fb.seek(max(offset - 1, 0))
+    if offset > 0 and fb.read(1) != b'\n':
+        # skip the rest of a line that was entered midway
+        line = fb.readline(read_chunk_size)
+        while line and not line.endswith(b'\n'):
+            line = fb.readline(read_chunk_size)
+    decoder = json.JSONDecoder()
+    while True:
+        start = fb.tell()
+        line = fb.readline(read_chunk_size)
+        if not line:
+            return None
+        if not line.lstrip().startswith(b'{'):
+            while line and not line.endswith(b'\n'):
+                line = fb.readline(read_chunk_size)
+            continue
+        # a JSON string can't contain a raw newline, so a line that
+        # starts with { is an object. read until it decodes
+        text = line.decode('utf-8').lstrip()
+        while True:
             try:
-                message = next(m)
-            except StopIteration:
-                # append the rest of calls onto merged
-                fill = c
+                obj, _ = decoder.raw_decode(text)
+                break
+            except json.JSONDecodeError:
+                more = fb.readline(read_chunk_size)
+                if not more:
+                    return None
+                text += more.decode('utf-8')
+        if isinstance(obj, dict) and key in obj:
+            return start, obj[key]
+        fb.seek(start + len(line))
+        while line and not line.endswith(b'\n'):
+            line = fb.readline(read_chunk_size)
+### END helper function for seek_date()
+
+
+def stream_json_member(f, key, chunk_size=None):
+    """Yields the elements of the array that is the value of key in
+    the top level JSON object in the text file f. The values of the
+    other keys are scanned past without being parsed, holding at most
+    a chunk (or one string) in memory. Raises KeyError if there is no
+    such key."""
+    chunk_size = chunk_size or read_chunk_size
+    buf = f.read(chunk_size)
+    pos = 0
+
+    def fill():
+        # drop what has been consumed and read another chunk
+        nonlocal buf, pos
+        chunk = f.read(chunk_size)
+        if not chunk:
+            raise ValueError(f'{getattr(f, "name", f)}: unexpected end of JSON')
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def skip_space():
+        nonlocal pos
+        while True:
+            pos = json_skip_pattern.match(buf, pos).end()
+            if pos < len(buf):
+                return
+            fill()
+
+    skip_space()
+    if buf[pos] != '{':
+        raise ValueError(f'{getattr(f, "name", f)}: not a JSON object')
+    pos += 1
+
+    while True:
+        # json_skip_pattern also skips the comma between members
+        skip_space()
+        if buf[pos] == '}':
+            raise KeyError(key)
+        m = json_string_pattern.match(buf, pos)
+        while m is None:
+            fill()
+            m = json_string_pattern.match(buf, pos)
+        name = json.loads(m.group())
+        pos = m.end()
+        skip_space()
+        pos += 1  # the colon
+        skip_space()
+
+        if name == key:
+            yield from stream_json_array(f, chunk_size, prefix=buf[pos:])
+            return
+
+        # skip the value by counting brackets outside strings
+        depth = 0
+        while True:
+            m = json_structure_pattern.search(buf, pos)
+            if m is None:
+                pos = len(buf)
+                fill()
+                continue
+            c = m.group()
+            if c == '"':
+                end = json_string_pattern.match(buf, m.start())
+                if end is None:
+                    # the string continues in the next chunk
+                    pos = m.start()
+                    fill()
+                    continue
+                pos = end.end()
+            elif c in '[{':
+                depth += 1
+                pos = m.end()
+            elif depth == 0:
+                # the , or } after a value that is not an array or object
+                pos = m.start()
                 break
-    for o in fill:
-        merged.append(o)
-    return merged
-
-### BEGIN Helper function for merge_longest()
-def datetime_key(o):
-    if 'start_time' in o:
-        return o['start_time']
-    if 'date' in o:
-        return o['date']
-    raise TypeError
-### END Helper function for merge_longest()
+            elif c == ',':
+                pos = m.end()
+            else:
+                depth -= 1
+                pos = m.end()
+                if depth == 0:
+                    break
+
+
+def stream_json_array(f, chunk_size=None, inside=False, prefix=''):
+    """Yields the elements of the JSON array in the text file f one
+    at a time. At most one element plus a chunk of unparsed text is
+    held in memory, so memory does not grow with the size of f.
+    If inside is true, f is already positioned past the opening
+    bracket, e.g. on an element found by seek_date(). prefix is text
+    already read from f, e.g. by stream_json_member()."""
+    chunk_size = chunk_size or read_chunk_size
+    decoder = json.JSONDecoder()
+    buf = prefix + f.read(chunk_size)
+    pos = json_skip_pattern.match(buf).end()
+    if not inside:
+        if buf[pos:pos + 1] != '[':
+            raise ValueError(f'{getattr(f, "name", f)}: not a JSON array')
+        pos += 1
+    eof = False
+
+    while True:
+        pos = json_skip_pattern.match(buf, pos).end()
+        if pos < len(buf) and buf[pos] == ']':
+            return
+        try:
+            if pos == len(buf):
+                raise json.JSONDecodeError('Expecting value', buf, pos)
+            obj, end = decoder.raw_decode(buf, pos)
+            if not eof and (end == len(buf) or buf[end] not in json_delimiters):
+                # a number may have been cut short by the end of the
+                # buffer, e.g. 15000000000. decodes as 15000000000
+                raise json.JSONDecodeError('Truncated value', buf, end)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # element straddles the end of the buffer, so drop what has
+            # been consumed and read more. the read size grows with the
+            # buffer so a large element is not re-parsed chunk by chunk
+            chunk = f.read(max(chunk_size, len(buf) - pos))
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        yield obj
+        pos = end
+        if pos >= chunk_size:
+            buf = buf[pos:]
+            pos = 0
+
+
+def involves(rec, pn):
+    """Whether the call or message rec is to or from phone number pn,
+    or the event rec mentions it."""
+    if rec.kind == 'call':
+        return pn == rec.obj['caller'] or pn == rec.obj['called']
+    if rec.kind == 'event':
+        return pn == rec.number
+    return pn == rec.obj['contact_value']
 ### END Helper functions for merge_calls_messages()
 
 
-def json2txt(obj):
-    incoming, outgoing, me = 1, 2, '+15037564626'
+def read_events(source, d1, d2):
+    """Yields the events of source, one of event_sources, between d1
+    and d2 in chronological order, as Records, or nothing, with a
+    warning, if the package doesn't have its file."""
+    (label, reader, name, member) = event_sources[source]
+    if not package.exists(name):
+        print_err('warning', f'{package.file_path(name)}: not found, skipping {source} events')
+        return
+    yield from reader(source, name, member,
+                      *dates2ms(datetime.fromisoformat(d1), datetime.fromisoformat(d2)))
+
+### BEGIN helper functions for read_events()
+def read_json_events(source, name, member, t1, t2):
+    """Yields the events between epoch milliseconds t1 and t2 in the
+    JSON file name, or in the array member of its top level object,
+    sorted by time. Every object found by json_objects() that has a
+    time is an event. The file is streamed if it holds an array or
+    member is given, and only the events in range are sorted."""
+    events = []
+    with package.open(name) as f:
+        if member is not None:
+            objs = stream_json_member(f, member)
+        else:
+            head = f.read(read_chunk_size)
+            if head.lstrip().startswith('['):
+                objs = (obj for value in stream_json_array(f, prefix=head)
+                        for obj in json_objects(value))
+            else:
+                objs = json_objects(json.loads(head + f.read()))
+        try:
+            for obj in objs:
+                if not isinstance(obj, dict):
+                    continue
+                ts = object_time(obj)
+                if ts is not None and t1 <= ts <= t2:
+                    events.append(event_record(source, obj, ts,
+                        (v for v in obj.values() if isinstance(v, str))))
+        except KeyError:
+            print_err('warning', f'{package.file_path(name)}: no {member}, skipping {source} events')
+    # a stable sort keeps the order of the file on equal timestamps
+    events.sort(key=record_key)
+    yield from events
+
+def json_objects(value):
+    """Yields the objects in the JSON value: the elements of an array,
+    or of each array of objects in an object, recursively, or else the
+    object itself."""
+    if isinstance(value, list):
+        for v in value:
+            yield from json_objects(v)
+    elif isinstance(value, dict):
+        arrays = [v for v in value.values() if isinstance(v, list) and v
+                  and all(isinstance(x, dict) for x in v)]
+        if not arrays:
+            yield value
+        for v in arrays:
+            yield from json_objects(v)
+
+def object_time(obj):
+    """Returns the time of the event obj in epoch milliseconds: the
+    value of the first of event_time_keys it has, else its first string
+    that is an ISO datetime, or None if it has neither."""
+    for key in event_time_keys:
+        if key in obj:
+            ts = event_time(obj[key])
+            if ts is not None:
+                return ts
+    for value in obj.values():
+        if isinstance(value, str) and log_time_pattern.fullmatch(value):
+            return event_time(value)
+    return None
+
+def event_time(value):
+    """Returns an ISO datetime string (UTC unless it has an offset), or
+    a number of epoch seconds or milliseconds, in epoch milliseconds,
+    or None if value is neither."""
+    if isinstance(value, str):
+        try:
+            dt = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return round(dt.timestamp() * 1000)
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0:
+        # seconds until the year 5138, milliseconds after
+        return round(value * 1000) if value < 1e11 else round(value)
+    return None
+
+def read_client_logs(source, name, member, t1, t2):
+    """Yields the entries between epoch milliseconds t1 and t2 of the
+    log files in directory name and its subdirectories, plain or
+    gzipped, in chronological order."""
+    names = package.listfiles(name)
+    with ThreadPoolExecutor(log_threads) as executor:
+        spans = list(executor.map(scan_log, names))
+    # (first, position, last, ordered, name) of each file in range
+    files = sorted((first, i, last, ordered, n) for (i, (n, (first, last, ordered)))
+                   in enumerate(zip(names, spans))
+                   if first is not None and first <= t2 and last >= t1)
+
+    heap = []  # (ts, position, record, iterator) of each open file
+    readers = []
+    i = 0
+    try:
+        while i < len(files) or heap:
+            # open the files whose first entry comes before the next one
+            while i < len(files) and (not heap or files[i][0] <= heap[0][0]):
+                (first, position, last, ordered, n) = files[i]
+                reader = Prefetch(read_log(source, n, ordered))
+                readers.append(reader)
+                it = iter(reader)
+                rec = next(it, None)
+                if rec is not None:
+                    heapq.heappush(heap, (rec.ts, position, rec, it))
+                i += 1
+            if not heap:
+                continue
+            (ts, position, rec, it) = heap[0]
+            following = next(it, None)
+            if following is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (following.ts, position, following, it))
+            if ts > t2:
+                break
+            if ts >= t1:
+                yield rec
+    finally:
+        for reader in readers:
+            reader.close()
+
+def scan_log(name):
+    """Returns (first, last, ordered) of the log file name: the times of
+    its earliest and latest entries, or None if it has none, and whether
+    its entries are in chronological order."""
+    first = last = None
+    ordered = True
+    for (ts, num, lines) in log_entries(name):
+        if first is None:
+            first = last = ts
+            continue
+        if ts < last:
+            ordered = False
+        first, last = min(first, ts), max(last, ts)
+    return (first, last, ordered)
+
+def read_log(source, name, ordered):
+    """Yields the entries of the log file name as Records, sorted if
+    they are not already in order."""
+    entries = (event_record(source, {'file': name, 'line': num, 'text': '\n'.join(lines)},
+                            ts, lines)
+               for (ts, num, lines) in log_entries(name))
+    if ordered:
+        yield from entries
+    else:
+        yield from sorted(entries, key=record_key)
+
+def log_entries(name):
+    """Yields (time, line number, [line, ...]) of each entry of the log
+    file name, in the order of the file. An entry starts with a line
+    holding an ISO datetime, and lines without one continue it, e.g. a
+    stack trace. Lines before the first entry are skipped. Files ending
+    in .gz are decompressed, and text that isn't utf-8 is replaced."""
+    with package.open(name, 'rb') as fb:
+        f = gzip.open(fb) if name.endswith('.gz') else fb
+        entry = None
+        for (num, line) in enumerate(io.TextIOWrapper(f, encoding='utf-8', errors='replace'),
+                                     start=1):
+            line = line.rstrip('\r\n')
+            m = log_time_pattern.search(line)
+            ts = m and event_time(m.group())
+            if ts is None:
+                if entry is not None:
+                    entry[2].append(line)
+                continue
+            if entry is not None:
+                yield entry
+            entry = (ts, num, [line])
+        if entry is not None:
+            yield entry
+### END helper functions for read_events()
+
+### BEGIN helper class for read_client_logs()
+class Prefetch:
+    """Iterates over an iterator that is run in a thread of its own,
+    which reads ahead of the consumer by up to prefetch_batches batches
+    of prefetch_batch_size items."""
+
+    def __init__(self, it):
+        self.queue = queue.Queue(prefetch_batches)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(it,), daemon=True)
+        self.thread.start()
+
+    def run(self, it):
+        it = iter(it)
+        try:
+            for batch in iter(lambda: list(itertools.islice(it, prefetch_batch_size)), []):
+                if not self.put(batch):
+                    return
+            self.put(None)
+        except Exception as e:
+            self.put(e)
+
+    def put(self, item):
+        # give up if the consumer has stopped reading
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            if isinstance(batch, Exception):
+                raise batch
+            yield from batch
+
+    def close(self):
+        self.stopped.set()
+### END helper class for read_client_logs()
+
+
+def json2txt(rec, opts, contacts):
     obj_type_text = {
         'in':              'INCOMING CALL',
         'out':             'OUTGOING CALL',
@@ -129,128 +1128,105 @@ def json2txt(obj):
         'voicemail-media': 'VOICEMAIL',
         'media':           'MEDIA MESSAGE'
     }
-    audio_formats = ['.wav', '.mp4', '.3gpp', '.AMR']
-    img_formats = ['.gif', '.jpeg', '.png']
-    vm_dir = Path('textnow-data', 'voicemail')
-    media_dir = Path('textnow-data', 'media')
-    iso = obj['date'] if 'date' in obj else obj['start_time']
-    dt = iso2localf(iso)
-    arrow = '&mdash;&gt;' if args.html else '-->'
-
-    if args.html:
+    obj = rec.obj
+    iso = obj['date'] if rec.kind == 'message' else obj.get('start_time')
+    ldt, tz = epoch2local(rec.ts / 1000)
+    dt = localf(ldt, tz)
+    arrow = '&mdash;&gt;' if opts.html else '-->'
+
+    if opts.html:
         eol = '<br>\n'
-        txt = f'<li id="{iso2id(iso)}">\n'
+        txt = [f'<li id="{local_id(ldt)}">\n']
     else:
         eol = '\n'
-        txt = ''
+        txt = []
+
+    # phone number
+    pn = rec.number
+    contact = contacts.name(pn)
+    if opts.redact:
+        pn = redact(pn)
+    direction = rec.direction
+    obj_type = rec.type
 
     # MESSAGE OBJECT
-    if 'date' in obj:
-        # phone number
-        pn = normalize_number(obj['contact_value'])
-        contact = get_contact_name(pn)
-        if args.redact:
-            pn = redact(pn)
-        direction = obj['direction']
-
-        # get message type. message types are: text, voicemail, media
-        url_regex = r'https://(voicemail-media|media)\.textnow\.com/?\?h=(.*)'
-        url_match = re.match(url_regex, obj['message'])
-
-        if url_match:
-            obj_type = url_match.group(1)
-            media_file = parse.unquote(url_match.group(2))
-        elif re.match('^Missed call from', obj['message']):
-            obj_type = 'missed-call'
-            media_file = None
-        else:
-            obj_type = 'text'
-            media_file = None
+    if rec.kind == 'message':
 
         # TEXT MESSAGE
         if obj_type == 'text':
             if direction == incoming:
-                txt += f'{contact} {pn} {arrow} Me' + eol
+                txt.append(f'{contact} {pn} {arrow} Me' + eol)
             else:
-                txt += f'Me {arrow} {contact} {pn}' + eol
-            txt += f'[{dt}]' + eol
-            txt += f'"{obj["message"]}"' + eol
+                txt.append(f'Me {arrow} {contact} {pn}' + eol)
+            txt.append(f'[{dt}]' + eol)
+            txt.append(f'"{obj["message"]}"' + eol)
 
         elif obj_type == 'missed-call':
-            txt += f'MISSED CALL: {contact} {pn}' + eol
-            txt += f'[{dt}]' + eol
+            txt.append(f'MISSED CALL: {contact} {pn}' + eol)
+            txt.append(f'[{dt}]' + eol)
 
         # VOICEMAIL MESSAGE
         elif obj_type == 'voicemail-media':
             # Case: file exists but in wrong directory
-            found = False
-            for d in [vm_dir, media_dir]:
-                vm_path =  vm_dir / media_file
-                if vm_path.exists():
-                    found = True
-                    break
+            (found, vm_path, mime, original) = resolve_media(rec)
 
             print(found, iso, vm_path)
-            txt += f'{obj_type_text[obj_type]}: {get_contact_name(pn)} {pn}' + eol
-            txt += f'[{dt}]' + eol
-            txt += f'FILENAME: {vm_path}' + eol
-            if args.html:
-                txt += f'<audio controls src="{vm_path}"></audio>' + eol
+            txt.append(f'{obj_type_text[obj_type]}: {contacts.name(pn)} {pn}' + eol)
+            txt.append(f'[{dt}]' + eol)
+            txt.append(f'FILENAME: {vm_path}' + eol)
+            if opts.html:
+                src = media_src(original, opts)
+                txt.append(f'<audio controls preload="none" src="{src}"></audio>' + eol)
 
         # MEDIA MESSAGE
         elif obj_type == 'media':
             # Case: file exists but in wrong directory
-            # Case: filename portion of url has no extension, but file does. use glob
-            found = False
-            for d in [media_dir, vm_dir]:
-                media_path = d / media_file
-                if media_path.exists():
-                    found = True
-                    break
-
-                media_files = list(d.glob(media_file + '*'))
-                if len(media_files) > 1:
-                    raise ValueError('Duplicate files: '+str(media_files))
-
-                if len(media_files) == 1:
-                    media_path = media_files[0]
-                    found = True
-                    break
+            # Case: filename portion of url has no extension, but file does
+            (found, media_path, mime, original) = resolve_media(rec)
 
             print(found, iso, media_path)
             if direction == incoming:
-                txt += f'{contact} {pn} {arrow} Me' + eol
+                txt.append(f'{contact} {pn} {arrow} Me' + eol)
             else:
-                txt += f'Me {arrow} {contact} {pn}' + eol
-            txt += f'[{dt}]' + eol
-            txt += f'FILE: {media_path}' + eol
-
-            media_path_ext = Path(media_path).suffix
-            if args.html:
-                if media_path_ext in audio_formats:
-                    txt += f'<audio controls src="{media_path}"></audio>' + eol
-                elif media_path_ext in img_formats:
-                    txt += f'<img src="{media_path}" alt="{media_path}">' + eol
+                txt.append(f'Me {arrow} {contact} {pn}' + eol)
+            txt.append(f'[{dt}]' + eol)
+            txt.append(f'FILE: {media_path}' + eol)
+
+            # embed by the type sniffed from the file, not its name, and
+            # link a copy of an earlier file to that file
+            if opts.html and mime is not None:
+                if mime.startswith(audio_types):
+                    txt.append(f'<audio controls preload="none" src="{media_src(original, opts)}"></audio>' + eol)
+                elif mime.startswith('image/'):
+                    txt.append(f'<img loading="lazy" src="{media_src(original, opts)}" alt="{media_path}">' + eol)
 
         else:
             print(obj)
             raise TypeError('Unknown message type')
 
     # CALL OBJECT
-    elif 'start_time' in obj:
-        caller = normalize_number(obj['caller'])
-        called = normalize_number(obj['called'])
-        obj_type, direction, pn = {
-            True: ('in', incoming, caller),
-            False: ('out', outgoing, called)
-        }[called == me]
-        contact = get_contact_name(pn)
-        if args.redact:
-            pn = redact(pn)
-
-        txt += f'{obj_type_text[obj_type]}: {contact} {pn}' + eol
-        txt += f'[{dt}]' + eol
-        txt += f"DURATION: {format_duration(obj['duration'])}" + eol
+    elif rec.kind == 'call':
+        txt.append(f'{obj_type_text[obj_type]}: {contact} {pn}' + eol)
+        txt.append(f'[{dt}]' + eol)
+        txt.append(f"DURATION: {format_duration(obj['duration'])}" + eol)
+
+    # EVENT (login, session, device, client log, ...)
+    elif rec.kind == 'event':
+        (label, reader, name, member) = event_sources[obj_type]
+        if obj_type == 'client_logs':
+            origin, text = f"{obj['file']}:{obj['line']}", obj['text']
+        else:
+            origin = name if member is None else f'{name} {member}'
+            text = ', '.join(f'{k}: {v if isinstance(v, str) else json.dumps(v, ensure_ascii=False)}'
+                             for (k, v) in obj.items())
+        if opts.redact:
+            origin = redact_pattern.sub(r'\1XXXX', origin)
+            text = redact_pattern.sub(r'\1XXXX', text)
+        if opts.html:
+            origin, text = html.escape(origin), html.escape(text)
+        txt.append(f'{label}: {origin}' + eol)
+        txt.append(f'[{dt}]' + eol)
+        txt.append(text.replace('\n', eol) + eol)
 
     # unknown object
     else:
@@ -258,43 +1234,297 @@ def json2txt(obj):
         raise TypeError('Unknown object type')
 
     # # add timestamp
-    # txt += f'[{dt}]' + eol
+    # txt.append(f'[{dt}]' + eol)
 
-    if args.html:
-        txt += '</li>\n'
+    if opts.html:
+        txt.append('</li>\n')
     else:
-        txt += eol
-    return txt
+        txt.append(eol)
+    return ''.join(txt)
 
 ### BEGIN helper functions for json2txt()
-def iso2id(iso):
-    return datetime.fromisoformat(iso).astimezone().strftime('%a-%b-%d-%Y-%I-%M-%S')
+def describe(rec, opts, contacts):
+    """Returns the fields json2txt() works out for a record: the
+    normalized number and contact name of the other party, the
+    direction, the type (in, out, text, missed-call, media,
+    voicemail-media), the resolved media path and its sniffed MIME
+    type, or None. For an event, its source instead."""
+    if rec.kind == 'event':
+        return {'type': 'event', 'source': rec.type}
+    media_path = mime = None
+    if rec.media is not None:
+        (found, media_path, mime, original) = resolve_media(rec)
+
+    pn = rec.number
+    contact = contacts.name(pn)
+    return {
+        'number': redact(pn) if opts.redact else pn,
+        'contact': contact,
+        'direction': rec.direction,
+        'type': rec.type,
+        'media_path': None if media_path is None else str(media_path),
+        'media_type': mime
+    }
+
+def media_src(path, opts):
+    """The path of a media file as linked from an HTML transcript. The
+    pages of a paged transcript are a directory below the working
+    directory, so their links are relative to that directory."""
+    if opts.pages:
+        return Path(os.path.relpath(path, opts.file.parent)).as_posix()
+    return path
+
+def message_type(message):
+    """Returns (type, media file) of a message. Types are: text,
+    missed-call, voicemail-media, media. Media file is None for
+    text and missed-call."""
+    url_match = media_url_pattern.match(message['message'])
+
+    if url_match:
+        return url_match.group(1), parse.unquote(url_match.group(2))
+    elif message['message'].startswith('Missed call from'):
+        return 'missed-call', None
+    else:
+        return 'text', None
+
+def resolve_media(rec):
+    """Returns (found, path, MIME type, original path) of the media file
+    of a media or voicemail message, as found by find_media() and
+    media_info(). It is looked up once per record, however many
+    transcripts the record is rendered for."""
+    if rec.resolved is None:
+        if rec.type == 'voicemail-media':
+            (found, path) = find_media(rec.media, ['voicemail', 'media'])
+        else:
+            (found, path) = find_media(rec.media, ['media', 'voicemail'],
+                                       any_extension=True)
+        rec.resolved = (found, path, *media_info(path))
+    return rec.resolved
+
+def find_media(media_file, dirs, any_extension=False):
+    """Returns (found, path) for media_file, looking in each of the
+    package directories dirs in turn. If any_extension is true a file whose name is media_file
+    plus an extension also matches; where several do, load_media_index()
+    has already chosen one. If the file is not found, path is
+    media_file in the voicemail directory."""
+    global media_index
+    if media_index is None:
+        media_index = load_media_index()
+
+    for d in dirs:
+        names = media_index[d]['keys'].get(media_file, [])
+        if media_file in names:
+            return True, package.file_path(d, media_file)
+        if any_extension and names:
+            return True, package.file_path(d, names[0])
+    return False, package.file_path('voicemail', media_file)
+
+def load_media_index():
+    """Returns {directory name: {'keys': {key: [file name, ...]},
+    'files': {file name: [signature, MIME type, sha256, original]}}}
+    for the media and voicemail directories, cached in
+    package.media_index_path."""
+    media_index_path = package.media_index_path
+    try:
+        with open(media_index_path, encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache.get('version') != media_index_version:
+            cache = {}
+    except (FileNotFoundError, json.JSONDecodeError):
+        cache = {}
+
+    changed = False
+    index = {}
+    for d in ['media', 'voicemail']:
+        sig = package.signature(d)
+        listing = cache.get(d)
+        if listing is None or listing['signature'] != sig:
+            files = listing['files'] if listing is not None else {}
+            signatures = package.scandir(d)
+            names = sorted(signatures)
+            stale = [n for n in names if files.get(n, [None])[0] != signatures[n]]
+            with ThreadPoolExecutor(media_threads) as executor:
+                sniffed = dict(zip(stale, executor.map(
+                    lambda n: sniff_media(f'{d}/{n}'), stale)))
+            files = {n: sniffed[n] if n in sniffed else files[n][1:]
+                     for n in names}
+            listing = cache[d] = {'signature': sig, 'files': {
+                n: [signatures[n], *files[n]] for n in names}}
+            changed = True
+
+        keys = {}
+        for name in listing['files']:
+            keys.setdefault(name, []).append(name)
+            dot = name.find('.')
+            while dot != -1:
+                keys.setdefault(name[:dot], []).append(name)
+                dot = name.find('.', dot + 1)
+        for (key, names) in keys.items():
+            if len(names) > 1 and key not in names:
+                if len({listing['files'][n][2] for n in names}) > 1:
+                    print_err('warning', f'{package.file_path(d, key)}: duplicate files '
+                              f'{", ".join(names)}, using {names[0]}')
+                keys[key] = names[:1]
+        index[d] = {'keys': keys, 'files': {}}
+
+    # the first file with each content
+    originals = {}
+    for d in ['media', 'voicemail']:
+        for (name, entry) in cache[d]['files'].items():
+            original = originals.setdefault(entry[2], [d, name])
+            index[d]['files'][name] = entry + [original]
+
+    if changed:
+        cache['version'] = media_index_version
+        try:
+            with open(media_index_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f)
+        except OSError as e:
+            print_err('warning', f'could not save media index: {e}')
+    return index
+
+def sniff_media(name):
+    """Returns [MIME type, sha256] of the package file name."""
+    digest = hashlib.sha256()
+    with package.open(name, 'rb') as f:
+        head = f.read(media_sniff_size)
+        digest.update(head)
+        for chunk in iter(lambda: f.read(write_buffer_size), b''):
+            digest.update(chunk)
+    return [sniff_mime(head), digest.hexdigest()]
+
+def sniff_mime(head):
+    """Returns the MIME type of a file that starts with the bytes head,
+    or application/octet-stream if it is not one of media_magic."""
+    for (offset, magic, mime) in media_magic:
+        if head.startswith(magic, offset):
+            if mime == 'video/mp4' and head[8:11] == b'3gp':
+                return 'video/3gpp'
+            if mime == 'audio/wav' and head[8:12] != b'WAVE':
+                return 'image/webp' if head[8:12] == b'WEBP' else 'application/octet-stream'
+            return mime
+    return 'application/octet-stream'
+
+def media_info(path):
+    """Returns (MIME type, original path) of the media file at path as
+    found by find_media(), where original is the path of the first file
+    with the same content, or (None, path) if it isn't in the package."""
+    entry = media_index[path.parent.name]['files'].get(path.name)
+    if entry is None:
+        return (None, path)
+    return (entry[1], package.file_path(*entry[3]))
+
+def local_id(ldt):
+    """The id of the HTML entry of a record at local time ldt, which
+    links to it must keep to, e.g. Sun-Mar-13-2016-05-55-50."""
+    return ldt.strftime('%a-%b-%d-%Y-%I-%M-%S')
 
 def iso2localf(iso):
     """Converts an ISO datetime string to a local datetime string
     in human-readable format. """
+    return localf(*local_time(iso))
+
+def localf(ldt, tz):
+    """Formats a local datetime and its time zone abbreviation.
+    Format: Sat Nov 02 2024 01:30:53 AM PDT"""
+    return f"{ldt.strftime('%a %b %d %Y %I:%M:%S %p')} {tz}"
+
+def local_time(iso):
+    """Returns (naive local datetime, time zone abbreviation) for an
+    ISO datetime string."""
+    return epoch2local(datetime.fromisoformat(iso).timestamp())
+
+def epoch2local(epoch):
+    """Returns (naive local datetime, time zone abbreviation) for
+    epoch seconds, using the cached local time offset."""
+    start, end, offset, tz = local_offset_span(epoch)
+    return utc_epoch + timedelta(seconds=epoch + offset), tz
+
+def epochs2local(epochs):
+    """The batched form of epoch2local() for a sequence of epoch
+    seconds, e.g. a whole export. The offset span is only looked up
+    again when an epoch falls outside the previous one, so a sorted
+    sequence costs one lookup per DST transition."""
+    result = []
+    start = end = 0
+    for epoch in epochs:
+        if not start <= epoch < end:
+            start, end, offset, tz = local_offset_span(epoch)
+        result.append((utc_epoch + timedelta(seconds=epoch + offset), tz))
+    return result
+
+### BEGIN helper functions for epoch2local()
+def local_offset_span(epoch):
+    """Returns (start, end, offset, tz) of the span of epoch seconds
+    around epoch in which the local UTC offset is offset seconds and
+    the zone abbreviation is tz. Spans are bounded by DST transitions
+    and cached, so the system time zone is only consulted a few dozen
+    times per transition instead of once per timestamp.
+
+    The cache is read without locking, e.g. by the request threads of
+    tde serve. A span found is only used if it holds epoch, so a lookup
+    that races an insert falls through to the locked path."""
+    span = cached_offset_span(epoch)
+    if span is not None:
+        return span
+
+    with local_offset_lock:
+        # another thread may have cached it while this one waited
+        span = cached_offset_span(epoch)
+        if span is not None:
+            return span
+        offset, tz = probe_local_offset(epoch)
+        # walk a week at a time to the neighbouring transitions, which are
+        # months apart, then bisect to the second. spans are capped at a
+        # year either side
+        start = transition_bound(epoch, -1, (offset, tz))
+        end = transition_bound(epoch, 1, (offset, tz)) + 1
+        span = (start, end, offset, tz)
+        # spans are found around uncached epochs, so they never overlap
+        # a cached span: insert in order. the span goes in first, so
+        # local_offset_spans is never shorter than local_offset_starts
+        i = bisect.bisect_left(local_offset_starts, start)
+        local_offset_spans.insert(i, span)
+        local_offset_starts.insert(i, start)
+    return span
+
+def cached_offset_span(epoch):
+    """Returns the cached span holding epoch, or None."""
+    i = bisect.bisect_right(local_offset_starts, epoch) - 1
+    if i >= 0:
+        span = local_offset_spans[i]
+        if span[0] <= epoch < span[1]:
+            return span
+    return None
+
+def transition_bound(epoch, direction, local):
+    """Returns the last whole second from epoch in direction (-1 or 1)
+    whose local offset is still local."""
+    week = 7 * 86400
+    inside = int(epoch)
+    for _ in range(53):
+        outside = inside + direction * week
+        if probe_local_offset(outside) != local:
+            break
+        inside = outside
+    else:
+        return inside
+    # inside has the offset, outside doesn't
+    while abs(outside - inside) > 1:
+        mid = (inside + outside) // 2
+        if probe_local_offset(mid) == local:
+            inside = mid
+        else:
+            outside = mid
+    return inside
 
-    # local datetime
-    ldt = datetime.fromisoformat(iso).astimezone()
-
-    # local datetime formatted
-    # Format: Sat Nov 02 2024 01:30:53 AM
-    ldtf = ldt.strftime('%a %b %d %Y %I:%M:%S %p')
-
-    tz = {
-        'Pacific Daylight Time': 'PDT',
-        'Pacific Standard Time': 'PST'
-    }[ldt.tzname()]
-
-    s = f'{ldtf} {tz}'
-    return s
-
-def get_contact_name(num):
-    # try:
-    c = contacts.get(normalize_number(num), '')
-    # except KeyError:
-    #     c = ''
-    return c
+def probe_local_offset(epoch):
+    """Returns (offset seconds, zone abbreviation) of the system time
+    zone at epoch."""
+    ldt = datetime.fromtimestamp(epoch, timezone.utc).astimezone()
+    name = ldt.tzname()
+    return int(ldt.utcoffset().total_seconds()), tz_abbreviations.get(name, name)
+### END helper functions for epoch2local()
 
 def format_duration(d):
     m, s = divmod(d, 60)
@@ -306,9 +1536,33 @@ def redact(pn):
     if pn == 'Restricted':
         return pn
     return pn[0:8] + 'XXXX'
+
+def redact_fields(obj):
+    """Returns a copy of the call or message obj with the last four
+    digits of the phone numbers in its number fields replaced with X's,
+    as redact() does, however they are formatted."""
+    obj = dict(obj)
+    for key in redacted_fields:
+        if isinstance(obj.get(key), str):
+            obj[key] = redact_pattern.sub(r'\1XXXX', obj[key])
+    # the text of a missed call is the caller's number
+    if obj.get('message', '').startswith('Missed call from'):
+        obj['message'] = redact_pattern.sub(r'\1XXXX', obj['message'])
+    return obj
+
+def redact_strings(v):
+    """Returns a copy of the event object v with the last four digits
+    of the phone numbers in every string in it replaced with X's."""
+    if isinstance(v, str):
+        return redact_pattern.sub(r'\1XXXX', v)
+    if isinstance(v, dict):
+        return {k: redact_strings(x) for (k, x) in v.items()}
+    if isinstance(v, list):
+        return [redact_strings(x) for x in v]
+    return v
 ### END helper functions for json2txt()
 
-### BEGIN helper function for get_contact_name(),
+### BEGIN helper function for ContactMap.name(),
 ### get_contact_from_user_shard(), and json2html()
 def normalize_number(v):
     """If v is of the form /\\+?1?\\d{10}/
@@ -317,11 +1571,82 @@ def normalize_number(v):
     # if no match v will be 'Restricted' or 'Unknown number'
     m = value_pattern.fullmatch(v)
     return f'+1{m.group(1)}' if m else v
-### END helper function for get_contact_name(),
+### END helper function for ContactMap.name(),
 ### get_contact_from_user_shard(), and json2html()
 
 
 def parse_args():
+    parser = make_parser()
+
+    # command line arguments
+    # cl = ''
+    # cl = '-h'
+    # cl = '-p 3603601072 -dd 2021-01-01 2024-12-31 --html'
+    # cl = '-dd 2024-01-01 2024-12-31 -p 5033449503 -r --html'
+    # cl = '-dd 2024-11-05 2025-02-28 -p 5035726103 --html -f post-incident-calls-and-messages.html -r'
+    # cl = '-d 2024-11-01 -f pre-incident-calls-and-messages.html --html -r'
+    # cl = '-dd 2024-11-02 2024-11-04 -f incident-calls-and-messages.html --html -r'
+    # cl = '-dd 2023-03-07T16:49:30 2023-03-07t16:49:40 --html -f text-messages-regarding-e-1.html -r'
+    # cl = '-dd 2023-03-07T21:00 2023-03-08t23:00 --html -f text-messages-regarding-e-2.html -r'
+    # cl = '-d 2017-02-11 --html -r'
+
+    cl = sys.argv[1:]
+
+    # `tde.py index` is the same as `tde.py --index`, and `tde.py serve`
+    # as `tde.py --serve`
+    if cl[:1] in (['index'], ['serve']):
+        cl[0] = '--' + cl[0]
+
+    # the package is opened before parsing the rest of the arguments
+    # because the actions for -c, -n, -p, -t and --index read from it
+    global package, server_url
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument('--package', default=default_package_path)
+    pre_parser.add_argument('--server')
+    # or --serve would be taken for an abbreviation of --server
+    pre_parser.add_argument('--serve', nargs='?')
+    pre_parser.add_argument('--profile', nargs='?', const='')
+    pre_args = pre_parser.parse_known_args(cl)[0]
+    # profile the whole run, including the actions run while parsing
+    if pre_args.profile is not None:
+        start_profiling(pre_args.profile)
+    # with --server the package is read by the server, not here
+    server_url = pre_args.server
+    if server_url is not None:
+        unsupported = [opt for opt in server_excluded_options if opt in cl]
+        if unsupported:
+            print_err('error', f'{", ".join(unsupported)}: not supported with --server', fatal=True)
+    try:
+        package = Package(pre_args.package)
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        print_err('error', e, fatal=True)
+
+    if len(cl) == 0:
+        parser.print_usage()
+        exit(1)
+
+    args = parser.parse_args(cl)
+
+    # a query without words would match every message
+    if args.search is not None and not tokenize(args.search):
+        print_err('error', f'-s/--search: no words to search for in {args.search!r}', fatal=True)
+
+    if args.batch:
+        transcripts = read_batch_file(parser, args.batch)
+        # -u/--update on the command line applies to every transcript
+        for opts in transcripts:
+            opts.update = opts.update or args.update
+    else:
+        check_transcript_args(args)
+        transcripts = [args]
+    # each record is read, classified and its media looked up once,
+    # then rendered in each format
+    args.transcripts = [t for opts in transcripts for t in split_formats(opts)]
+
+    return args
+
+### BEGIN helper functions for parse_args()
+def make_parser():
     parser = argparse.ArgumentParser(
         description='''Merges call and message data chronologically 
         from textnow-data/calls.json and textnow-data/messages.json 
@@ -352,6 +1677,14 @@ def parse_args():
                         action=PrintMatchingContactsAndExitAction,
                         metavar='PATTERN',
                         help='List all contacts matching %(metavar)s and exit')
+    top_level_group.add_argument('-i', '--index',
+                        action=BuildIndexAndExitAction,
+                        nargs=0,
+                        help='Build an index of the package used to speed up later queries and exit')
+    top_level_group.add_argument('--serve',
+                        action=ServeAction,
+                        nargs='?', type=int, const=default_port, metavar='PORT',
+                        help='Load the package once and answer queries about it over HTTP on localhost:%(metavar)s (default: %(const)s), as `tde.py serve`')
     top_level_group.add_argument('-p', '--phone',
                         action=ValidatePhoneNumberAction,
                         help='Phone # of contact to extract call/message data from',)
@@ -371,7 +1704,16 @@ def parse_args():
                         help='Output as HTML document.')
     file_type_group.add_argument('-j', '--json',
                         action='store_true', default=False,
-                        help='Output as JSON.')
+                        help='Output as a JSON array.')
+    file_type_group.add_argument('--ndjson',
+                        action='store_true', default=False,
+                        help='Output as newline-delimited JSON, one record per line.')
+    file_type_group.add_argument('--formats',
+                        type=format_list, metavar='FORMATS',
+                        help='Save the transcript in each of the comma separated %(metavar)s (txt, html, json, ndjson) from one read of the package, to FILE with the suffix of each format, e.g. --formats txt,html,ndjson')
+    parser.add_argument('-e', '--events',
+                        nargs='?', type=event_source_list, const=list(event_sources), metavar='SOURCES',
+                        help=f'Also extract the login, session, device and client log events of the comma separated %(metavar)s ({",".join(event_sources)}, default all) in the same dates, mentioning -p/--phone if given')
     parser.add_argument('-r', '--redact',
                         action='store_true', default=False,
                         help='Redact phone numbers.')
@@ -379,63 +1721,190 @@ def parse_args():
                         type=Path,
                         default=default_output_file,
                         help='Save call & message data to FILE')
-
-    # command line arguments
-    # cl = ''
-    # cl = '-h'
-    cl = '-p 3603601072 -dd 2021-01-01 2024-12-31 --html'
-    # cl = '-dd 2024-01-01 2024-12-31 -p 5033449503 -r --html'
-    # cl = '-dd 2024-11-05 2025-02-28 -p 5035726103 --html -f post-incident-calls-and-messages.html -r'
-    # cl = '-d 2024-11-01 -f pre-incident-calls-and-messages.html --html -r'
-    # cl = '-dd 2024-11-02 2024-11-04 -f incident-calls-and-messages.html --html -r'
-    # cl = '-dd 2023-03-07T16:49:30 2023-03-07t16:49:40 --html -f text-messages-regarding-e-1.html -r'
-    # cl = '-dd 2023-03-07T21:00 2023-03-08t23:00 --html -f text-messages-regarding-e-2.html -r'
-    # cl = '-d 2017-02-11 --html -r'
-
-    cl = cl.split()
-
-    if len(cl) == 0:
-        parser.print_usage()
-        exit(1)
-
-    args = parser.parse_args(cl)
-
-    if args.dates is None:
-        print('No dates specified')
-        parser.print_usage()
-        exit(1)
-
-    return args
+    parser.add_argument('--pages',
+                        type=page_size, metavar='PERIOD',
+                        help='With --html, save one page per month, or per %(metavar)s records if it is a number, in a directory named after FILE, and an index of the pages to FILE')
+    parser.add_argument('-z', '--compress',
+                        nargs='?', const='gzip', choices=['gzip', 'zstd'], metavar='METHOD',
+                        help='Compress FILE with %(metavar)s (gzip or zstd, default gzip) while it is written, adding .gz or .zst to its name. A FILE ending in .gz or .zst is compressed without it. zstd falls back to gzip if Python has no zstd module')
+    parser.add_argument('-u', '--update',
+                        action='store_true', default=False,
+                        help='Append only the calls/messages newer than the last ones saved to an existing FILE')
+    parser.add_argument('-s', '--search',
+                        metavar='QUERY',
+                        help='Only extract messages containing every word of %(metavar)s')
+    parser.add_argument('--context',
+                        type=int, default=0, metavar='N',
+                        help='With -s/--search, also extract N calls/messages with the same contact before and after each match (default: %(default)s)')
+    parser.add_argument('--stats',
+                        nargs='?', const='year', choices=['year', 'month'], metavar='PERIOD',
+                        help='Print call and message statistics per contact and per %(metavar)s (year or month, default year) instead of saving a transcript')
+    parser.add_argument('-b', '--batch',
+                        type=Path, metavar='FILE',
+                        help='Save a transcript for each line of FILE, reading the package once. Each line holds -p, -d/-dd, --html/-j/--ndjson/--formats, --pages, -e, -r, -z, -u and -f options')
+    parser.add_argument('--jobs',
+                        type=int, default=1, metavar='N',
+                        help='Render entries in N worker processes (default: %(default)s)')
+    parser.add_argument('--profile',
+                        nargs='?', const='', metavar='FILE',
+                        help='Print the time, CPU time, count and peak memory of each stage of the run to stderr, and save them as JSON to FILE, or cProfile statistics if FILE ends in .prof')
+    parser.add_argument('--server',
+                        metavar='URL',
+                        help='Query the tde serve at %(metavar)s, e.g. http://127.0.0.1:8618, instead of reading the package. Supports -c, -t, -n, -p, -d/-dd, the output formats, -r and -f')
+    parser.add_argument('--package',
+                        default=default_package_path,
+                        help='The disclosure package, either the ZIP file or the directory it was extracted to (default: %(default)s)')
+
+    return parser
+
+def page_size(v):
+    """The type of --pages: 'month' or a number of records."""
+    if v == 'month':
+        return v
+    try:
+        n = int(v)
+    except ValueError:
+        n = 0
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"expected 'month' or a number of records, got {v!r}")
+    return n
+
+def format_list(v):
+    """The type of --formats: a comma separated list of txt, html, json
+    and ndjson."""
+    formats = []
+    for fmt in v.split(','):
+        if fmt not in content_types:
+            raise argparse.ArgumentTypeError(
+                f"unknown format {fmt!r}, expected some of {','.join(content_types)}")
+        if fmt not in formats:
+            formats.append(fmt)
+    return formats
+
+def split_formats(opts):
+    """Returns the options of each transcript to save for the options of
+    one transcript: one per format with --formats, each saved to FILE
+    with the suffix of its format, else opts itself."""
+    if not opts.formats:
+        return [opts]
+    transcripts = []
+    for fmt in opts.formats:
+        format_opts = argparse.Namespace(**vars(opts))
+        format_opts.html, format_opts.json, format_opts.ndjson = (
+            fmt == 'html', fmt == 'json', fmt == 'ndjson')
+        # a compressed FILE keeps its compression suffix
+        compression = opts.file.suffix if opts.file.suffix in compression_suffixes else ''
+        base = opts.file.with_suffix('') if compression else opts.file
+        format_opts.file = base.with_suffix(f'.{fmt}{compression}')
+        # --pages only splits the HTML transcript
+        if fmt != 'html':
+            format_opts.pages = None
+        transcripts.append(format_opts)
+    return transcripts
+
+def event_source_list(v):
+    """The type of -e/--events: a comma separated list of the names in
+    event_sources, or 'all'."""
+    if v == 'all':
+        return list(event_sources)
+    sources = v.split(',')
+    for source in sources:
+        if source not in event_sources:
+            raise argparse.ArgumentTypeError(
+                f"unknown source {source!r}, expected 'all' or some of {','.join(event_sources)}")
+    return sources
+
+def read_batch_file(parser, path):
+    """Returns the parsed options of each transcript listed in the
+    batch file at path. Each line holds the options for one transcript,
+    e.g. -p 5032271212 -dd 2024-05-01 2024-05-31 --html -f may.html
+    Blank lines and lines starting with # are ignored."""
+    transcripts = []
+    try:
+        with open(path, encoding='utf-8') as f:
+            lines = f.readlines()
+    except OSError as e:
+        print_err('error', e, fatal=True)
+    for num, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        cl = shlex.split(line)
+        if any(opt in cl for opt in batch_excluded_options):
+            print_err('error', f'{path}:{num}: {line}: not allowed in a batch file',
+                      fatal=True)
+        opts = parser.parse_args(cl)
+        check_transcript_args(opts)
+        transcripts.append(opts)
+    if not transcripts:
+        print_err('error', f'{path}: no transcripts listed', fatal=True)
+    return transcripts
+
+def check_transcript_args(opts):
+    """Fills in the dates of one transcript if none were given, and if
+    no file was specified, sets the file extension from the output
+    format."""
+    if opts.pages and not (opts.html or 'html' in (opts.formats or ())):
+        print_err('error', '--pages only applies to --html', fatal=True)
+    if opts.pages and opts.update:
+        print_err('error', '-u/--update can not be used with --pages', fatal=True)
+
+    # no dates means the whole history, which the server knows
+    if opts.dates is None and server_url is None:
+        opts.dates = get_default_date_interval()
+
+    # if --html/--json/--ndjson option specified, change file extension
+    if str(opts.file) == default_output_file:
+        if opts.html:
+            opts.file = opts.file.with_suffix('.html')
+        elif opts.json:
+            opts.file = opts.file.with_suffix('.json')
+        elif opts.ndjson:
+            opts.file = opts.file.with_suffix('.ndjson')
+
+    # -z/--compress adds the suffix of its method to the file name
+    if opts.compress and compression_suffixes.get(opts.file.suffix) != opts.compress:
+        suffix = next(s for (s, m) in compression_suffixes.items() if m == opts.compress)
+        opts.file = opts.file.with_name(opts.file.name + suffix)
+    method = compression_suffixes.get(opts.file.suffix)
+    if method == 'zstd' and zstd is None:
+        print_err('warning', f'{opts.file}: no zstd module (Python 3.14 or the zstandard package), compressing with gzip')
+        opts.file = opts.file.with_suffix('.gz')
+    if method is not None and opts.update:
+        print_err('error', '-u/--update can not be used with compressed output', fatal=True)
+    if method is not None and opts.pages:
+        print_err('error', '--pages can not be used with compressed output', fatal=True)
+### END helper functions for parse_args()
 
 # BEGIN helper classes for parse_args()
 
 class ValidatePhoneNumberAction(argparse.Action):
     def __call__(self, parser, ns, phone_number, option_string=None):
-        global contacts
-        contacts = get_contacts_from_user_shard()
         phone_number = normalize_number(phone_number)
-        if phone_number not in contacts:
+        # the server checks the number itself
+        if server_url is None and phone_number not in package.contacts():
             exit(f'No results for {phone_number}')
         ns.phone = phone_number
 
 
-class PrintDatetimeLimitsAndExitAction(argparse.Action):
+class BuildIndexAndExitAction(argparse.Action):
     def __call__(self, parser, namespace, values, option_strings=None):
-        d = {}
-        # load call data
-        with open('textnow-data/calls.json', encoding='utf-8') as f:
-            call_data = json.load(f)
-
-        d[self.fdt(call_data[0]['start_time'])] = 'calls.json'
-        d[self.fdt(call_data[-1:][0]['start_time'])] = 'calls.json'
-        del call_data
+        build_index()
+        print(f'Saved to "{package.index_path}"')
+        exit()
 
-        # load message data
-        with open('textnow-data/messages.json', encoding="utf-8") as f:
-            message_data = json.load(f)
 
-        d[self.fdt(message_data[0]['date'])] = 'messages.json'
-        d[self.fdt(message_data[-1:][0]['date'])] = 'messages.json'
+class PrintDatetimeLimitsAndExitAction(argparse.Action):
+    def __call__(self, parser, namespace, values, option_strings=None):
+        if server_url is not None:
+            with query_server('timespan') as response:
+                timespan = json.load(response)
+        else:
+            timespan = get_timespan()
+        d = {}
+        for (name, (first, last)) in timespan.items():
+            d[self.fdt(first)] = name
+            d[self.fdt(last)] = name
 
         for dt in sorted(d.keys()):
             print(dt, d[dt])
@@ -450,10 +1919,8 @@ class PrintDatetimeLimitsAndExitAction(argparse.Action):
 
 class PrintContactsAndExitAction(argparse.Action):
     def __call__(self, parser, namespace, pattern, option_strings=None):
-        global contacts
-        contacts = get_contacts_from_user_shard()
         num = 0
-        for (p, n) in contacts.items():
+        for (p, n) in server_contacts() if server_url else package.contacts().items():
             print(f'"{n}", {p}')
             num += 1
         print(num, 'contacts')
@@ -462,18 +1929,28 @@ class PrintContactsAndExitAction(argparse.Action):
 
 class PrintMatchingContactsAndExitAction(argparse.Action):
     def __call__(self, parser, namespace, pattern, option_strings=None):
-        global contacts
-        contacts = get_contacts_from_user_shard()
         num = 0
-        for (p, n) in contacts.items():
-            if re.search(pattern, n, flags=re.IGNORECASE):
-                print(n, p)
-                num += 1
+        for (p, n) in (server_contacts(pattern) if server_url
+                       else package.contacts().search(pattern)):
+            print(n, p)
+            num += 1
         if num == 0:
             print(f'No results for "{pattern}"')
         exit()
 
 
+class ServeAction(argparse.Action):
+    def __call__(self, parser, namespace, port, option_strings=None):
+        serve(port)
+        exit()
+
+
+def server_contacts(pattern=None):
+    """The contacts, or those matching pattern, from the server."""
+    with query_server('contacts', pattern=pattern) as response:
+        return json.load(response)
+
+
 class ValidateAndNormalizeDateIntervalAction(argparse.Action):
     def __init__(self, option_strings, dest, **kwargs):
         super().__init__(option_strings, dest, **kwargs)
@@ -524,23 +2001,694 @@ def print_err(level, msg, fatal=False):
         exit(1)
 
 
-def format_header():
-    if args.phone:
-        pn = args.phone
-        contact = get_contact_name(pn)
-        if args.redact:
+class Profiler:
+    """Records the wall time, CPU time, count and peak memory of each
+    stage of a run, a function listed in profiled_stages, for --profile."""
+
+    def __init__(self):
+        self.stats = {}  # name: [count, wall, cpu, peak]
+        # each running stage: [name, wall start, cpu start, wall of
+        # the stages it called, their cpu, memory at start, peak]
+        self.stack = []
+        self.peak = 0  # of the whole run, as the stages reset tracemalloc's
+        tracemalloc.start()
+        self.wall, self.cpu = time.perf_counter(), time.process_time()
+
+    def instrument(self, stages):
+        """Wraps each function of stages, a list of (stage name,
+        function name, whether it returns an iterator of records)."""
+        module = sys.modules[__name__]
+        for (name, target, iterator) in stages:
+            owner, _, attr = target.rpartition('.')
+            owner = getattr(module, owner) if owner else module
+            setattr(owner, attr, self.timed(name, getattr(owner, attr), iterator))
+
+    def timed(self, name, func, iterator):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self.enter(name)
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                self.exit(0 if iterator else 1)
+            return self.iterate(name, result) if iterator else result
+        return wrapper
+
+    def iterate(self, name, it):
+        """Yields the items of it, timing each step as stage name."""
+        it = iter(it)
+        try:
+            while True:
+                self.enter(name)
+                try:
+                    item = next(it)
+                except StopIteration:
+                    self.exit(0)
+                    return
+                except BaseException:
+                    self.exit(0)
+                    raise
+                self.exit(1)
+                yield item
+        finally:
+            close = getattr(it, 'close', None)
+            if close is not None:
+                close()
+
+    def enter(self, name):
+        (current, peak) = tracemalloc.get_traced_memory()
+        if self.stack:
+            parent = self.stack[-1]
+            parent[6] = max(parent[6], peak)
+        tracemalloc.reset_peak()
+        self.stats.setdefault(name, [0, 0.0, 0.0, 0])
+        self.stack.append([name, time.perf_counter(), time.process_time(),
+                           0.0, 0.0, current, current])
+
+    def exit(self, count):
+        (name, wall, cpu, child_wall, child_cpu, base, peak) = self.stack.pop()
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        s = self.stats[name]
+        s[0] += count
+        s[1] += wall - child_wall
+        s[2] += cpu - child_cpu
+        s[3] = max(s[3], peak - base)
+        self.peak = max(self.peak, peak)
+        if self.stack:
+            parent = self.stack[-1]
+            parent[3] += wall
+            parent[4] += cpu
+            parent[6] = max(parent[6], peak)
+
+    def report(self):
+        """Returns the totals of the run and the figures of each stage."""
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        stages = [{'stage': name, 'count': count, 'wall': w, 'cpu': c, 'peak_kb': p / 1024}
+                  for (name, (count, w, c, p)) in self.stats.items()]
+        return {'wall': wall, 'cpu': cpu,
+                'untimed_wall': wall - sum(s['wall'] for s in stages),
+                'peak_kb': max(self.peak, tracemalloc.get_traced_memory()[1]) / 1024,
+                'stages': stages}
+
+def start_profiling(file):
+    """Starts --profile, which prints the figures of each stage when
+    the run ends and, if file is given, saves them as JSON or, if file
+    ends in .prof, saves cProfile statistics of the run."""
+    profiler = Profiler()
+    profiler.instrument(profiled_stages)
+    cprofile = None
+    if file and file.endswith('.prof'):
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+
+    def finish():
+        if cprofile is not None:
+            cprofile.disable()
+            cprofile.dump_stats(file)
+        report = profiler.report()
+        tracemalloc.stop()
+        print_profile(report)
+        if file and cprofile is None:
+            with open(file, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+        if file:
+            print(f'Profile saved to "{file}"', file=sys.stderr)
+    atexit.register(finish)
+
+### BEGIN helper function for start_profiling()
+def print_profile(report):
+    err = sys.stderr
+    print(f'{"STAGE":<16} {"COUNT":>10} {"WALL S":>9} {"CPU S":>9} {"PEAK KB":>10}', file=err)
+    for s in report['stages']:
+        print(f'{s["stage"]:<16} {s["count"]:>10} {s["wall"]:>9.3f} {s["cpu"]:>9.3f} '
+              f'{s["peak_kb"]:>10.0f}', file=err)
+    print(f'{"(untimed)":<16} {"":>10} {report["untimed_wall"]:>9.3f}', file=err)
+    print(f'{"TOTAL":<16} {"":>10} {report["wall"]:>9.3f} {report["cpu"]:>9.3f} '
+          f'{report["peak_kb"]:>10.0f}', file=err)
+### END helper function for start_profiling()
+
+
+def print_stats(records, contacts, period, redacted):
+    """Prints the number of incoming and outgoing calls and messages,
+    the total and mean call duration, the ratio of incoming to
+    outgoing records and the busiest hour of each contact, then the
+    same counts per period (year or month). The records are loaded into
+    columns and each figure is one grouped sum over them."""
+    numbers = {}  # number -> contact id
+    periods = {}  # period -> period id
+    contact = array('q')
+    period_id = array('q')
+    hour = array('q')
+    epoch = array('d')
+    columns = {name: array('d') for name in stats_columns}
+
+    for rec in records:
+        contact.append(numbers.setdefault(rec.number, len(numbers)))
+        epoch.append(rec.ts / 1000)
+        is_in = rec.direction == incoming
+        call = rec.kind == 'call'
+        columns['calls in'].append(call and is_in)
+        columns['calls out'].append(call and not is_in)
+        columns['messages in'].append(not call and is_in)
+        columns['messages out'].append(not call and not is_in)
+        columns['talk time'].append(rec.obj['duration'] if call else 0)
+
+    if not numbers:
+        return False
+
+    fmt = '%Y' if period == 'year' else '%Y-%m'
+    for (ldt, tz) in epochs2local(epoch):
+        hour.append(ldt.hour)
+        period_id.append(periods.setdefault(ldt.strftime(fmt), len(periods)))
+
+    def totals(keys, n):
+        return {name: bincount(keys, col, n) for (name, col) in columns.items()}
+
+    # per contact
+    n = len(numbers)
+    by_contact = totals(contact, n)
+    hours = bincount(array('q', (c * 24 + h for (c, h) in zip(contact, hour))),
+                     None, n * 24)
+    print(f'{"CONTACT":<20} {"NUMBER":<13} {"CALLS IN":>8} {"CALLS OUT":>9} '
+          f'{"TALK TIME":>12} {"MEAN CALL":>10} {"MSGS IN":>8} {"MSGS OUT":>8} '
+          f'{"IN/OUT":>6} {"BUSIEST HOUR":>12}')
+    rows = []
+    for (pn, c) in numbers.items():
+        t = {name: by_contact[name][c] for name in stats_columns}
+        calls = t['calls in'] + t['calls out']
+        ins = t['calls in'] + t['messages in']
+        outs = t['calls out'] + t['messages out']
+        busiest = max(range(24), key=lambda h: hours[c * 24 + h])
+        rows.append((-(ins + outs), contacts.name(pn),
+                     redact(pn) if redacted else pn, t, calls, ins, outs, busiest))
+    for (_, name, pn, t, calls, ins, outs, busiest) in sorted(rows, key=lambda r: r[:2]):
+        mean = format_duration(t['talk time'] / calls) if calls else '-'
+        ratio = f'{ins / outs:.2f}' if outs else '-'
+        print(f'{name[:20]:<20} {pn:<13} {int(t["calls in"]):>8} {int(t["calls out"]):>9} '
+              f'{format_duration(t["talk time"]):>12} {mean:>10} '
+              f'{int(t["messages in"]):>8} {int(t["messages out"]):>8} '
+              f'{ratio:>6} {busiest:>9}:00')
+    print(len(numbers), 'contacts')
+    print()
+
+    # per period
+    by_period = totals(period_id, len(periods))
+    print(f'{period.upper():<8} {"CALLS IN":>8} {"CALLS OUT":>9} {"TALK TIME":>12} '
+          f'{"MSGS IN":>8} {"MSGS OUT":>8}')
+    for (p, i) in sorted(periods.items()):
+        t = {name: by_period[name][i] for name in stats_columns}
+        print(f'{p:<8} {int(t["calls in"]):>8} {int(t["calls out"]):>9} '
+              f'{format_duration(t["talk time"]):>12} '
+              f'{int(t["messages in"]):>8} {int(t["messages out"]):>8}')
+    return True
+
+### BEGIN helper function for print_stats()
+def bincount(keys, weights, n):
+    """Returns a list of n sums of weights (or counts if weights is
+    None) grouped by keys, where keys and weights are arrays of the
+    same length. Vectorized with NumPy when it is installed."""
+    if numpy is not None:
+        keys = numpy.frombuffer(keys, dtype=numpy.int64)
+        if weights is not None:
+            weights = numpy.frombuffer(weights, dtype=numpy.float64)
+        return numpy.bincount(keys, weights=weights, minlength=n).tolist()
+    sums = [0] * n
+    if weights is None:
+        for k in keys:
+            sums[k] += 1
+    else:
+        for (k, w) in zip(keys, weights):
+            sums[k] += w
+    return sums
+### END helper function for print_stats()
+
+
+class Transcript:
+    """An output file for one set of transcript options. The file is
+    created when the first record is written, so a transcript with no
+    records leaves no file behind.
+
+    Next to the file a mark is saved recording the last record written
+    to it. With -u/--update the records up to the mark are skipped and
+    only the newer ones are appended, in place of the old footer.
+
+    If stream is given, the transcript is written to it instead, e.g.
+    the response to a query to tde serve, and no mark is saved."""
+
+    def __init__(self, opts, contacts, stream=None):
+        self.opts = opts
+        self.contacts = contacts
+        self.stream = stream
+        self.ante = opts.dates[0].isoformat()
+        self.post = opts.dates[1].isoformat()
+        (self.t1, self.t2) = dates2ms(*opts.dates)
+        self.file = None
+        self.count = 0
+        self.header = format_header(opts, contacts)
+        if opts.html:
+            self.header += '\n'
+        # the timestamp of the last record written and the number of
+        # records written with it
+        self.last, self.ties = None, 0
+        self.skipped = 0
+        self.mark = self.load_mark() if opts.update else None
+        self.start = opts.dates[0]
+        if self.mark is not None:
+            self.last, self.ties = self.mark['last'], self.mark['ties']
+            self.start = max(self.start, datetime.fromtimestamp(
+                self.last / 1000, timezone.utc))
+
+    def wants(self, rec):
+        """Whether rec falls in this transcript's dates, contact and
+        event sources, and is not already in the file being updated."""
+        if not (self.t1 <= rec.ts <= self.t2
+                and (self.opts.phone is None or involves(rec, self.opts.phone))):
+            return False
+        if rec.kind == 'event' and rec.type not in (self.opts.events or ()):
+            return False
+        if self.mark is not None and rec.ts <= self.mark['last']:
+            if rec.ts < self.mark['last']:
+                return False
+            # the file already holds the first ties records with the
+            # last timestamp
+            self.skipped += 1
+            if self.skipped <= self.mark['ties']:
+                return False
+        return True
+
+    def write(self, rec):
+        self.write_entry(render(rec, self.opts, self.contacts), rec.ts)
+
+    def write_entry(self, entry, ts):
+        """Writes an entry already rendered by render() for a record
+        with timestamp ts."""
+        if self.file is None:
+            self.open()
+        if self.opts.json and (self.count or self.mark is not None):
+            self.file.write(',\n')
+        self.file.write(entry)
+        self.count += 1
+        if ts == self.last:
+            self.ties += 1
+        else:
+            self.last, self.ties = ts, 1
+
+    def open(self):
+        # write each entry as it is rendered so the document is
+        # never held in memory
+        if self.stream is not None:
+            self.file = self.stream
+            self.file.write(self.header)
+            return
+        if self.mark is None:
+            self.file = open_output(self.opts.file)
+            self.file.write(self.header)
+            return
+        # the new entries replace the old footer, and the header is
+        # rewritten in place if the dates in it have changed
+        self.file = self.opts.file.open(
+            encoding='utf-8', mode='r+', buffering=write_buffer_size)
+        if self.header != self.mark['header']:
+            self.file.write(self.header)
+        self.file.seek(self.mark['footer'])
+        self.file.truncate()
+
+    def close(self):
+        if self.file is None and self.mark is not None \
+                and self.header != self.mark['header']:
+            # no new records, but the header is out of date
+            self.open()
+        if self.file is self.stream is not None:
+            self.file.write(format_footer(self.opts))
+        elif isinstance(self.file, CompressedWriter):
+            # a compressed file can't be updated, so it has no mark
+            self.file.write(format_footer(self.opts))
+            self.file.close()
+        elif self.file is not None:
+            footer = self.file.tell()
+            self.file.write(format_footer(self.opts))
+            self.file.close()
+            self.save_mark(footer)
+
+    def load_mark(self):
+        """Returns the mark saved with the file, or None, with a
+        warning, if the file has to be written in full."""
+        path = mark_path(self.opts.file)
+        try:
+            with open(path, encoding='utf-8') as f:
+                mark = json.load(f)
+            size = self.opts.file.stat().st_size
+        except FileNotFoundError:
+            print_err('warning', f'{self.opts.file}: nothing to update, writing it in full')
+            return None
+        except (OSError, ValueError) as e:
+            print_err('warning', f'{path}: {e}, writing {self.opts.file} in full')
+            return None
+        if mark.get('version') != mark_version or mark['size'] != size:
+            reason = 'has changed since it was written'
+        elif mark['options'] != mark_options(self.opts):
+            reason = 'was written with other options'
+        elif not same_shape(self.header, mark['header']):
+            reason = 'has a header that cannot be rewritten in place'
+        else:
+            return mark
+        print_err('warning', f'{self.opts.file} {reason}, writing it in full')
+        return None
+
+    def save_mark(self, footer):
+        """Saves the mark for the file just closed, whose footer starts
+        at the offset footer."""
+        mark = {
+            'version': mark_version,
+            'options': mark_options(self.opts),
+            'header': self.header,
+            'footer': footer,
+            'size': self.opts.file.stat().st_size,
+            'last': self.last,
+            'ties': self.ties,
+            'count': self.count + (self.mark['count'] if self.mark else 0),
+        }
+        try:
+            with open(mark_path(self.opts.file), 'w', encoding='utf-8') as f:
+                json.dump(mark, f, ensure_ascii=False, indent=1)
+        except OSError as e:
+            print_err('warning', f'could not save the mark for {self.opts.file}: {e}')
+
+### BEGIN helper functions for Transcript
+def mark_path(file):
+    return file.with_name(file.name + '.tde-mark.json')
+
+def mark_options(opts):
+    """The options a file must be updated with: those that change
+    which records it holds or how they are written."""
+    options = {
+        'phone': opts.phone,
+        'start': opts.dates[0].isoformat(),
+        'format': 'html' if opts.html else 'json' if opts.json
+                  else 'ndjson' if opts.ndjson else 'txt',
+        'redact': opts.redact,
+    }
+    # only if given, so marks saved without events still match
+    if opts.events:
+        options['events'] = sorted(opts.events)
+    return options
+
+def same_shape(h1, h2):
+    """Whether header h1 can overwrite header h2 in place: the same
+    number of bytes and lines once written."""
+    return (len(h1.encode('utf-8')) == len(h2.encode('utf-8'))
+            and h1.count('\n') == h2.count('\n'))
+
+def open_output(file):
+    """Opens file for writing text, compressed by a CompressedWriter if
+    its suffix is one of compression_suffixes."""
+    method = compression_suffixes.get(file.suffix)
+    if method is None:
+        return file.open(encoding='utf-8', mode='w', buffering=write_buffer_size)
+    return CompressedWriter(file, method)
+### END helper functions for Transcript
+
+### BEGIN helper class for Transcript
+class CompressedWriter:
+    """A text stream compressing what is written to it into the file at
+    path with method (gzip or zstd). The text is encoded and handed to a
+    background thread about write_buffer_size bytes at a time, through a
+    queue of at most compress_queue_size blocks, and the thread
+    compresses and writes it, so compression and disk writes overlap
+    with rendering."""
+
+    def __init__(self, path, method):
+        if method == 'gzip':
+            # wbits 31: a gzip header and trailer around the deflate stream
+            self.compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+        elif zstd.__name__ == 'zstandard':
+            self.compressor = zstd.ZstdCompressor().compressobj()
+        else:
+            self.compressor = zstd.ZstdCompressor()
+        self.raw = open(path, 'wb')
+        self.buf = []
+        self.size = 0
+        self.queue = queue.Queue(compress_queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, text):
+        self.buf.append(text)
+        self.size += len(text)
+        if self.size >= write_buffer_size:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self.error is not None:
+            raise self.error
+        if self.buf:
+            self.queue.put(''.join(self.buf).encode('utf-8'))
+            self.buf, self.size = [], 0
+
+    def run(self):
+        try:
+            for data in iter(self.queue.get, None):
+                self.raw.write(self.compressor.compress(data))
+            self.raw.write(self.compressor.flush())
+        except Exception as e:
+            self.error = e
+            # keep taking blocks so that the writer is never blocked
+            for data in iter(self.queue.get, None):
+                pass
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.queue.put(None)
+            self.thread.join()
+            self.raw.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+### END helper class for Transcript
+
+
+class PagedTranscript(Transcript):
+    """An HTML transcript saved as one page per month, or per
+    opts.pages records, in a directory named after the file, e.g.
+    calls/2024-05.html for calls.html, with the file itself an index of
+    the pages. The records of a page are collected until the next page
+    starts, then the page is rendered as a whole, in a worker process
+    if a pool has been given with use_pool()."""
+
+    def __init__(self, opts, contacts):
+        super().__init__(opts, contacts)
+        self.dir = opts.file.with_suffix('')
+        self.pages = []   # (name, title, count, first ts, last ts)
+        self.records = []  # the records of the page being collected
+        self.key = None
+        self.pool = None
+        self.pending = collections.deque()
+
+    def use_pool(self, pool, jobs):
+        self.pool, self.jobs = pool, jobs
+
+    def write(self, rec):
+        if self.opts.pages == 'month':
+            key = epoch2local(rec.ts / 1000)[0].strftime('%Y-%m')
+        else:
+            key = self.count // self.opts.pages
+        if key != self.key:
+            self.start_page(key)
+        self.records.append(rec)
+        self.count += 1
+
+    def start_page(self, key):
+        """Writes the page being collected, now that the name of the
+        page after it is known, and starts the page for key."""
+        if key is None:
+            name = title = None
+        elif self.opts.pages == 'month':
+            name = f'{key}.html'
+            title = datetime.strptime(key, '%Y-%m').strftime('%B %Y')
+        else:
+            name = f'{key + 1:04d}.html'
+            title = f'Page {key + 1}'
+        if self.records:
+            (prev, this) = self.pages[-2:] if len(self.pages) > 1 else (None, self.pages[-1])
+            this[2:] = [len(self.records), self.records[0].ts, self.records[-1].ts]
+            args = (self.opts, self.records, this[0], this[1],
+                    prev and prev[:2], name and [name, title])
+            if self.pool is None:
+                write_page(*args, self.contacts)
+            else:
+                self.pending.append(self.pool.apply_async(write_page_in_worker, args))
+                # bound the number of pages waiting to be written
+                while len(self.pending) > 2 * self.jobs:
+                    self.pending.popleft().get()
+        self.key = key
+        self.records = []
+        if key is not None:
+            self.pages.append([name, title])
+
+    def close(self):
+        if not self.pages:
+            return
+        self.start_page(None)
+        while self.pending:
+            self.pending.popleft().get()
+
+        # the index of the pages
+        with self.opts.file.open(encoding='utf-8', mode='w') as f:
+            f.write(self.header)
+            for (name, title, count, first, last) in self.pages:
+                href = parse.quote(f'{self.dir.name}/{name}')
+                f.write(f'<li><a href="{href}">{title}</a>: {count} calls/messages<br>\n'
+                        f'[{localf(*epoch2local(first / 1000))} &mdash; '
+                        f'{localf(*epoch2local(last / 1000))}]<br>\n</li>\n')
+            f.write(format_footer(self.opts))
+
+### BEGIN helper functions for PagedTranscript
+def write_page(opts, records, name, title, prev, next, contacts):
+    """Writes the page name of a paged transcript holding records.
+    prev and next are [name, title] of the pages either side of it,
+    or None."""
+    page_opts = argparse.Namespace(**vars(opts))
+    page_opts.file = opts.file.with_suffix('') / name
+    page_opts.dates = [datetime.fromtimestamp(records[i].ts / 1000, timezone.utc)
+                       for i in (0, -1)]
+
+    nav = [f'<a href="../{parse.quote(opts.file.name)}">Index</a>']
+    if prev:
+        nav.insert(0, f'<a href="{prev[0]}">&larr; {prev[1]}</a>')
+    if next:
+        nav.append(f'<a href="{next[0]}">{next[1]} &rarr;</a>')
+    nav = f'<li><nav>{title}: {" | ".join(nav)}</nav></li>\n'
+
+    page_opts.file.parent.mkdir(parents=True, exist_ok=True)
+    with page_opts.file.open(encoding='utf-8', mode='w',
+                             buffering=write_buffer_size) as f:
+        f.write(format_header(page_opts, contacts))
+        f.write('\n')
+        f.write(nav)
+        for rec in records:
+            f.write(render(rec, page_opts, contacts))
+        f.write(nav)
+        f.write(format_footer(page_opts))
+
+def write_page_in_worker(*args):
+    write_page(*args, worker_contacts)
+### END helper functions for PagedTranscript
+
+
+def render(rec, opts, contacts):
+    """Returns the entry for rec in the output format of opts. JSON
+    and NDJSON entries are the original record plus the fields worked
+    out by describe() under the key 'tde'."""
+    if opts.json or opts.ndjson:
+        obj = rec.obj
+        if opts.redact:
+            obj = redact_strings(obj) if rec.kind == 'event' else redact_fields(obj)
+        obj = {**obj, 'tde': describe(rec, opts, contacts)}
+        if opts.json:
+            return json.dumps(obj, ensure_ascii=False, indent=4)
+        return json.dumps(obj, ensure_ascii=False) + '\n'
+    return json2txt(rec, opts, contacts)
+
+
+def render_in_pool(records, transcripts, contacts, jobs):
+    """Renders records for transcripts in a pool of worker processes
+    and writes the entries in their original order, then closes the
+    transcripts. Records are sent to the workers in chunks of
+    render_chunk_size, and at most two chunks per worker are in
+    flight, so memory stays bounded. The pages of a paged transcript
+    are rendered whole by the same workers."""
+    global media_index
+    if media_index is None:
+        media_index = load_media_index()
+
+    initargs = (contacts, str(package.path), media_index,
+                [t.opts for t in transcripts])
+    with multiprocessing.Pool(jobs, init_render_worker, initargs) as pool:
+        paged = [isinstance(t, PagedTranscript) for t in transcripts]
+        for (t, p) in zip(transcripts, paged):
+            if p:
+                t.use_pool(pool, jobs)
+        pending = collections.deque()
+
+        def write_results(limit):
+            while len(pending) > limit:
+                for (i, ts, entry) in pending.popleft().get():
+                    transcripts[i].write_entry(entry, ts)
+
+        chunk = []
+        for rec in records:
+            wanted = []
+            for (i, t) in enumerate(transcripts):
+                if t.wants(rec):
+                    if paged[i]:
+                        t.write(rec)
+                    else:
+                        wanted.append(i)
+            if wanted:
+                chunk.append((rec, wanted))
+            if len(chunk) == render_chunk_size:
+                pending.append(pool.apply_async(render_chunk, (chunk,)))
+                chunk = []
+                write_results(2 * jobs)
+        if chunk:
+            pending.append(pool.apply_async(render_chunk, (chunk,)))
+        write_results(0)
+        for t in transcripts:
+            t.close()
+
+### BEGIN helper functions for render_in_pool()
+def init_render_worker(contact_map, package_path, media, transcript_opts):
+    """Sets up the globals of a worker process."""
+    global package, media_index, worker_opts, worker_contacts
+    worker_contacts = contact_map
+    package = Package(package_path)
+    media_index = media
+    worker_opts = transcript_opts
+
+def render_chunk(chunk):
+    """Returns [(transcript number, timestamp, entry), ...] for a chunk
+    of [(record, [transcript number, ...]), ...] in a worker process."""
+    return [(i, rec.ts, render(rec, worker_opts[i], worker_contacts))
+            for (rec, wanted) in chunk for i in wanted]
+### END helper functions for render_in_pool()
+
+
+def format_header(opts, contacts):
+    # a JSON transcript is an array of records, and an NDJSON
+    # transcript one record per line, with nothing around them
+    if opts.json:
+        return '[\n'
+    if opts.ndjson:
+        return ''
+
+    if opts.phone:
+        pn = opts.phone
+        contact = contacts.name(pn)
+        if opts.redact:
             pn = redact(pn)
         contact = f'{pn} {contact}'
     else:
         contact = 'All'
 
-    if args.html:
+    if opts.html:
         h = f'''<!doctype html>
 <html lang="en" data-bs-theme="dark">
 <head>
   <meta charset="utf-8">
   <meta name="viewport" content="width=device-width, initial-scale=1">
-  <title>{str(args.file)}</title>
+  <title>{str(opts.file)}</title>
   <link rel="icon" href="pentagram-icon.png" type="image/png">
   <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.8/dist/css/bootstrap.min.css" 
     rel="stylesheet" 
@@ -562,15 +2710,15 @@ li {{
 <hr>
 <div class="row">
 <div class="col-sm-3">FILENAME:</div>
-<div class="col-sm-9">{args.file}</div>
+<div class="col-sm-9">{opts.file}</div>
 </div>
 <div class="row">
 <div class="col-sm-3">START DATE:</div>
-<div class="col-sm-9">{iso2localf(ante)}</div>
+<div class="col-sm-9">{iso2localf(opts.dates[0].isoformat())}</div>
 </div>
 <div class="row">
 <div class="col-sm-3">END DATE:</div>
-<div class="col-sm-9">{iso2localf(post)}</div>
+<div class="col-sm-9">{iso2localf(opts.dates[1].isoformat())}</div>
 </div>
 <div class="row">
 <div class="col-sm-3">CONTACT(S):</div>
@@ -588,9 +2736,9 @@ li {{
 
     else:
         h = f'''{hr}  
-FILENAME   : {args.file}
-START DATE : {iso2localf(ante)}
-END DATE   : {iso2localf(post)}
+FILENAME   : {opts.file}
+START DATE : {iso2localf(opts.dates[0].isoformat())}
+END DATE   : {iso2localf(opts.dates[1].isoformat())}
 CONTACT(S) : {contact}
 
 (For source code see:
@@ -600,75 +2748,448 @@ https://github.com/petergrace1618/textnow-data-extractor/wiki)
     return h
 
 
+def format_footer(opts):
+    if opts.json:
+        return '\n]\n'
+    if opts.ndjson:
+        return ''
+
+    if opts.html:
+        f = '</ul>\n</main>\n<footer>\n<hr>\n'
+    else:
+        f = hr
+
+    f += f'END: {opts.file}\n'
+
+    if opts.html:
+        f += '</footer>\n</body>\n</html>'
+    return f
+
+
+class Timeline:
+    """All the calls and messages of the package, merged and held in
+    memory by tde serve, with the time of each record in an array for
+    bisection and the positions of each contact's records, so a query
+    only touches the records it returns."""
+
+    def __init__(self):
+        (first, last) = get_default_date_interval()
+        self.records = list(merge_calls_messages(first.isoformat(), last.isoformat(), None))
+        self.ts = array('q', (rec.ts for rec in self.records))
+        self.by_contact = {}
+        for (i, rec) in enumerate(self.records):
+            self.by_contact.setdefault(rec.number, array('l')).append(i)
+        # cache the local time offsets of the whole timeline now, so
+        # requests rarely have to wait to add a span
+        start = end = 0
+        for t in self.ts:
+            if not start <= t / 1000 < end:
+                start, end = local_offset_span(t / 1000)[:2]
+
+    def select(self, t1, t2, pn):
+        """Yields the records between epoch milliseconds t1 and t2 to
+        or from pn (all contacts if pn is None) in order."""
+        if pn is None:
+            i = bisect.bisect_left(self.ts, t1)
+            j = bisect.bisect_right(self.ts, t2)
+            return (self.records[k] for k in range(i, j))
+        positions = self.by_contact.get(pn, array('l'))
+        i = bisect.bisect_left(positions, t1, key=self.ts.__getitem__)
+        j = bisect.bisect_right(positions, t2, key=self.ts.__getitem__)
+        return (self.records[positions[k]] for k in range(i, j))
+
+
+def serve(port):
+    """Answers queries about the package over HTTP on localhost:port
+    until interrupted, from contacts, media listings and a Timeline
+    loaded once."""
+    global media_index, timeline
+    t0 = time.perf_counter()
+    package.contacts()
+    media_index = load_media_index()
+    timeline = Timeline()
+    server = ThreadingHTTPServer(('127.0.0.1', port), QueryHandler)
+    print(f'Loaded {len(timeline.records)} calls and messages from "{package.path}" '
+          f'in {time.perf_counter() - t0:.1f}s')
+    print(f'Serving on http://127.0.0.1:{server.server_port}/ (Ctrl-C to stop)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+### BEGIN helper classes for serve()
+class QueryHandler(BaseHTTPRequestHandler):
+    """GET /contacts[?pattern=P]: [[number, name], ...] as JSON
+    GET /timespan: {file name: [first, last]} as JSON
+    GET /transcript?phone=&from=&to=&format=&redact=&file=: a transcript
+    streamed as it is rendered. from and to are ISO datetimes, format is
+    txt, html, json or ndjson and file is the name shown in the header.
+    Anything missing takes the same default as on the command line."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = parse.urlsplit(self.path)
+        query = dict(parse.parse_qsl(url.query))
+        contacts = package.contacts()
+        try:
+            if url.path == '/contacts':
+                if 'pattern' in query:
+                    items = contacts.search(query['pattern'])
+                else:
+                    items = contacts.items()
+                self.send_json([[p, n] for (p, n) in items])
+            elif url.path == '/timespan':
+                self.send_json(timeline_timespan())
+            elif url.path == '/transcript':
+                self.send_transcript(query, contacts)
+            else:
+                self.send_error(404)
+        except (KeyError, ValueError, re.error) as e:
+            self.send_error(400, explain=str(e))
+
+    def send_json(self, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_transcript(self, query, contacts):
+        fmt = query.get('format', 'txt')
+        if fmt not in content_types:
+            raise ValueError(f'unknown format {fmt!r}')
+        pn = query.get('phone')
+        if pn is not None:
+            pn = normalize_number(pn)
+            if pn not in contacts:
+                return self.send_error(404, explain=f'No results for {pn}')
+        dates = list(get_default_date_interval())
+        for (i, key) in enumerate(['from', 'to']):
+            if key in query:
+                dates[i] = datetime.fromisoformat(query[key]).astimezone(timezone.utc)
+        opts = argparse.Namespace(
+            phone=pn, dates=dates, html=fmt == 'html', json=fmt == 'json',
+            ndjson=fmt == 'ndjson', redact=query.get('redact') == '1',
+            file=Path(query.get('file', f'tde-output.{fmt}')),
+            pages=None, update=False, events=None, formats=None, compress=None)
+
+        records = timeline.select(*dates2ms(*dates), pn)
+        first = next(records, None)
+        if first is None:
+            return self.send_error(404, explain=f'No results for {pn} between '
+                                   f'{dates[0].isoformat()} and {dates[1].isoformat()}')
+
+        stream = ChunkedWriter(self.wfile)
+        t = Transcript(opts, contacts, stream)
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_types[fmt])
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            with stream:
+                for rec in itertools.chain([first], records):
+                    t.write(rec)
+                t.close()
+        except Exception:
+            # the status has been sent, so an error can only be told
+            # to the client by ending the response without its last chunk
+            self.close_connection = True
+            self.log_error('%s', traceback.format_exc())
+
+    def send_error(self, code, message=None, explain=None):
+        # the explanation as plain text, for the command line to print
+        body = (explain or self.responses[code][0]).encode('utf-8')
+        self.send_response(code, message)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        print(f'{self.address_string()} {format % args}', file=sys.stderr)
+
+class ChunkedWriter:
+    """A text stream writing HTTP chunks of about write_buffer_size
+    bytes to the binary stream wfile."""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.buf = []
+        self.size = 0
+
+    def write(self, text):
+        self.buf.append(text)
+        self.size += len(text)
+        if self.size >= write_buffer_size:
+            self.flush()
+
+    def flush(self):
+        data = ''.join(self.buf).encode('utf-8')
+        self.buf, self.size = [], 0
+        if data:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+        if exc[0] is None:
+            self.wfile.write(b'0\r\n\r\n')
+
+def timeline_timespan():
+    """get_timespan() of the package loaded by serve(), computed once."""
+    global timespan
+    if timespan is None:
+        timespan = get_timespan()
+    return timespan
+### END helper classes for serve()
+
+
+def query_server(path, **params):
+    """Returns the response of the server at server_url to a query, or
+    exits with its explanation if it has no answer."""
+    url = f'{server_url.rstrip("/")}/{path}'
+    params = {k: v for (k, v) in params.items() if v is not None}
+    if params:
+        url += '?' + parse.urlencode(params)
+    try:
+        return request.urlopen(url)
+    except HTTPError as e:
+        exit(e.read().decode('utf-8', errors='replace'))
+    except URLError as e:
+        print_err('error', f'{server_url}: {e.reason}', fatal=True)
+
+def fetch_transcript(opts):
+    """Saves the transcript for opts from the server, streaming the
+    response to opts.file. Returns the number of characters saved."""
+    fmt = ('html' if opts.html else 'json' if opts.json
+           else 'ndjson' if opts.ndjson else 'txt')
+    dates = opts.dates or [None, None]
+    with query_server('transcript', phone=opts.phone, format=fmt, file=str(opts.file),
+                      redact='1' if opts.redact else None,
+                      **{'from': dates[0] and dates[0].isoformat(),
+                         'to': dates[1] and dates[1].isoformat()}) as response:
+        text = io.TextIOWrapper(response, encoding='utf-8')
+        with open_output(opts.file) as f:
+            return sum(f.write(chunk) for chunk in iter(
+                lambda: text.read(write_buffer_size), ''))
+
+
 # GLOBALS ------
-contacts = None
+incoming, outgoing, me = 1, 2, '+15037564626'
 hr = '-' * 60 + '\n'     # horizontal ruler
 value_pattern = re.compile(r'\+?1?(\d{10})')
+# a phone number, however formatted, up to its last four digits
+redact_pattern = re.compile(r'(\+?1?[ .-]?\(?\d{3}\)?[ .-]?\d{3}[ .-]?)\d{4}\b')
+redacted_fields = ['contact_value', 'contact_name', 'caller', 'called']  # by -r in JSON
 name_pattern = re.compile('[a-zA-Z]+$')
-default_date_interval = [
-    datetime.fromisoformat('2016-03-14T23:13:34.000Z'),
-    datetime.fromisoformat('2025-03-19T04:30:09.000Z')]
+word_pattern = re.compile(r'\w+')
+media_url_pattern = re.compile(r'https://(voicemail-media|media)\.textnow\.com/?\?h=(.*)')
+json_skip_pattern = re.compile(r'[\s,]*')  # whitespace and separators between array elements
+json_delimiters = ' \t\r\n,]'  # what may follow an array element
+json_string_pattern = re.compile(r'"(?:[^"\\]|\\.)*"')
+json_structure_pattern = re.compile(r'["\[\]{},]')
+log_time_pattern = re.compile(r'\d{4}-\d\d-\d\d[T ]\d\d:\d\d:\d\d(?:[.,]\d+)?(?:Z|[+-]\d\d:?\d\d)?')
+event_number_pattern = re.compile(r'\+1\d{10}')
+read_chunk_size = 1 << 16  # characters read at a time by stream_json_array()
+utc_epoch = datetime(1970, 1, 1)
+# Windows reports the full name of the time zone, other systems the
+# abbreviation
+tz_abbreviations = {
+    'Pacific Daylight Time': 'PDT',
+    'Pacific Standard Time': 'PST'
+}
+local_offset_starts = []  # start of each span in local_offset_spans
+local_offset_spans = []   # cached (start, end, offset, tz) spans, sorted
+local_offset_lock = threading.Lock()  # held while a span is added
+stats_columns = ['calls in', 'calls out', 'messages in', 'messages out', 'talk time']
+mark_version = 1  # bump when the layout of a mark changes
+write_buffer_size = 1 << 20  # bytes buffered by the output file
+# file suffix: compression method of -z/--compress
+compression_suffixes = {'.gz': 'gzip', '.zst': 'zstd'}
+gzip_level = 6  # zlib's default, as a trade of speed for size
+compress_queue_size = 4  # blocks waiting to be compressed per file
+render_chunk_size = 500  # records sent to a worker process at a time
+worker_opts = None  # transcript options in a worker process
+worker_contacts = None  # the ContactMap in a worker process
+default_package_path = 'textnow-data'
+package = None
+default_port = 8618  # of tde serve
+server_url = None  # set by --server, for the command line to query
+timeline = None  # the Timeline of tde serve
+timespan = None  # of the package of tde serve
+content_types = {
+    'txt': 'text/plain; charset=utf-8',
+    'html': 'text/html; charset=utf-8',
+    'json': 'application/json; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+media_index = None
+media_index_version = 3  # bump when the layout of the media index changes
+media_threads = 8  # media files sniffed and hashed at once
+media_sniff_size = 64  # bytes read to sniff the type of a media file
+# (offset, first bytes, MIME type) of the media files a package holds
+media_magic = [
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'RIFF', 'audio/wav'),  # or image/webp, see sniff_mime()
+    (4, b'ftyp', 'video/mp4'),  # or video/3gpp
+    (0, b'#!AMR', 'audio/amr'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'%PDF', 'application/pdf'),
+    (0, b'BEGIN:VCARD', 'text/vcard'),
+]
+# types embedded with <audio>, as the audio and video messages of TextNow
+# are voice recordings
+audio_types = ('audio/', 'video/mp4', 'video/3gpp')
+# source: (label, reader, file or directory, member of user_shard.json)
+# read by read_events() for -e/--events
+event_sources = {
+    'ips': ('IP ADDRESS', read_json_events, 'ips.json', None),
+    'central': ('ACCOUNT', read_json_events, 'central.json', None),
+    'sessions': ('SESSION', read_json_events, 'user_shard.json', 'sessions'),
+    'devices': ('DEVICE', read_json_events, 'user_shard.json', 'devices'),
+    'client_logs': ('CLIENT LOG', read_client_logs, 'client_logs', None),
+}
+# keys holding the time of an event, most likely first
+event_time_keys = ['timestamp', 'time', 'date', 'datetime', 'created_at', 'created',
+                   'login_time', 'start_time', 'last_seen', 'last_used', 'updated_at']
+log_threads = 8  # log files scanned at once by read_client_logs()
+prefetch_batches = 4  # batches read ahead of the merge by each Prefetch
+prefetch_batch_size = 256  # log entries in a batch
+index_sources = ['user_shard.json', 'calls.json', 'messages.json']
+index_version = 2  # bump when index_schema changes
+index_schema = '''
+CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE contacts (number TEXT PRIMARY KEY, name TEXT);
+CREATE TABLE calls (id INTEGER PRIMARY KEY, start_time TEXT,
+                    caller TEXT, called TEXT, json TEXT);
+CREATE TABLE messages (id INTEGER PRIMARY KEY, date TEXT,
+                       contact_value TEXT, type TEXT, json TEXT);
+CREATE TABLE terms (term TEXT, message_id INTEGER,
+                    PRIMARY KEY (term, message_id)) WITHOUT ROWID;
+CREATE TABLE frequencies (term TEXT PRIMARY KEY, count INTEGER);
+'''
+index_indexes = '''
+CREATE INDEX contacts_name ON contacts (name);
+CREATE INDEX calls_start_time ON calls (start_time);
+CREATE INDEX calls_caller ON calls (caller, start_time);
+CREATE INDEX calls_called ON calls (called, start_time);
+CREATE INDEX messages_date ON messages (date);
+CREATE INDEX messages_contact_value ON messages (contact_value, date);
+CREATE INDEX messages_type ON messages (type, date);
+'''
+default_date_interval = None  # set by get_default_date_interval()
+# (stage, function, whether it returns an iterator of records) timed by --profile
+profiled_stages = [
+    ('contacts', 'get_contacts_from_user_shard', False),
+    ('index query', 'query_calls', True),
+    ('index query', 'query_messages', True),
+    ('index query', 'query_terms', False),
+    ('index query', 'query_context', False),
+    ('seek', 'seek_date', False),
+    ('date range', 'stream_date_range', True),
+    ('parse', 'stream_json_array', True),
+    ('classify', 'Record.__init__', False),
+    ('filter', 'filter_contact', True),
+    ('merge', 'merge_sources', True),
+    ('events', 'read_events', True),
+    ('search', 'search_messages', True),
+    ('render', 'render', False),
+    ('render (pool)', 'render_in_pool', False),
+    ('media index', 'load_media_index', False),
+    ('media listing', 'Package.scandir', False),
+    ('media lookup', 'find_media', False),
+    ('tz conversion', 'epoch2local', False),
+    ('tz probe', 'probe_local_offset', False),
+    ('write', 'Transcript.write_entry', False),
+    ('write', 'Transcript.close', False),
+    ('write', 'PagedTranscript.close', False),
+    ('write', 'write_page', False),
+    ('stats', 'print_stats', False),
+]
 # 2017-12-13T23:21:48.000Z
 # The first occurrence of regex 'https://(media|voicemail-media)\.textnow\.com'
 default_output_file = 'tde-output.txt'
+server_excluded_options = ['-b', '--batch', '-s', '--search', '--stats', '--pages', '-e', '--events', '--formats',
+                           '-u', '--update', '--jobs', '-i', '--index', '--serve']
+batch_excluded_options = ['-b', '--batch', '--package', '--jobs', '--profile', '--server', '--serve',
+                          '-s', '--search', '--context', '--stats', '-c', '--contacts',
+                          '-t', '--timespan', '-n', '--name', '-i', '--index']
 # ---------------
 
 if __name__ == '__main__':
     args = parse_args()
     # print(args)
 
-    # if --html/--json option specified, change file extension
-    if str(args.file) == default_output_file:
-        if args.html:
-            args.file = args.file.with_suffix('.html')
-        elif args.json:
-            args.file = args.file.with_suffix('.json')
-
-    path = args.file
-
-    if contacts is None:
-        contacts = get_contacts_from_user_shard()
-
-    # ante facto, post facto
-    ante = args.dates[0].isoformat()
-    post = args.dates[1].isoformat()
-    calls_and_messages = merge_calls_messages(ante, post, args.phone)
-
-    if len(calls_and_messages) == 0:
-        exit(f'No results for {args.phone} between {ante} and {post}')
-
-    header = format_header()
-
-    if args.html:
-        body = '\n'
-    else:
-        body = ''
-
-    for obj in calls_and_messages:
-        if args.html:
-            body += json2txt(obj)
-        elif args.json:
-                body += json.dumps(obj, ensure_ascii=False, indent=4) + ',\n'
-        else:
-            body += json2txt(obj)
-
-    if args.html:
-        footer = '</ul>\n</main>\n<footer>\n<hr>\n'
-    else:
-        footer = hr
-
-    footer += f'END: {args.file}\n'
-
-    if args.html:
-        footer += '</footer>\n</body>\n</html>'
+    if server_url is not None:
+        fetch_transcript(args)
+        print(f'Saved to "{args.file}"')
+        exit()
 
-    doc = header + body + footer
+    contacts = package.contacts()
+
+    # list the media files, and report any duplicates, before any
+    # transcript is opened
+    if not args.stats and media_index is None:
+        media_index = load_media_index()
+
+    # read the package once over the union of the transcripts' date
+    # ranges, and route each record to every transcript it belongs in
+    transcripts = [(PagedTranscript if opts.pages else Transcript)(opts, contacts)
+                   for opts in args.transcripts]
+    ante = min(opts.dates[0] for opts in args.transcripts).isoformat()
+    post = max(opts.dates[1] for opts in args.transcripts).isoformat()
+    phones = {opts.phone for opts in args.transcripts}
+    pn = phones.pop() if len(phones) == 1 else None
+    # transcripts being updated are only read from their last record
+    start = min(t.start for t in transcripts).isoformat()
+    # the event sources of any of the transcripts
+    events = [source for source in event_sources
+              if any(source in (opts.events or ()) for opts in args.transcripts)]
+
+    if args.stats:
+        if not print_stats(merge_calls_messages(ante, post, pn),
+                           contacts, args.stats, args.redact):
+            exit(f'No results for {pn} between {ante} and {post}')
+        exit()
 
     try:
-        with path.open(encoding='utf-8', mode='w') as f:
-            f.write(doc)
-    except FileNotFoundError as e:
+        if args.search is not None:
+            records = search_messages(args.search, args.context, start, post, pn)
+        else:
+            records = merge_calls_messages(start, post, pn, events)
+        if args.jobs > 1:
+            render_in_pool(records, transcripts, contacts, args.jobs)
+        else:
+            for rec in records:
+                for t in transcripts:
+                    if t.wants(rec):
+                        t.write(rec)
+            for t in transcripts:
+                t.close()
+    except OSError as e:
         print(e)
         exit(2)
 
-    print(f'Saved to "{path}"')
+    for t in transcripts:
+        if t.mark is not None:
+            if t.count == 0:
+                print(f'No new records for "{t.opts.file}"')
+            else:
+                print(f'Appended {t.count} to "{t.opts.file}"')
+        elif t.count == 0:
+            msg = f'No results for {t.opts.phone} between {t.ante} and {t.post}'
+            if len(transcripts) == 1:
+                exit(msg)
+            print(msg)
+        else:
+            print(f'Saved to "{t.opts.file}"')